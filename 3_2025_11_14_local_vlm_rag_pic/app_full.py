@@ -1,16 +1,28 @@
+import asyncio
+import json
 import time
 import tempfile
 from pathlib import Path
+from typing import Optional
 import subprocess
 
 from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 from ollama_client import analyze_image_with_ollama
-from rag_pipeline import index_markdown, answer_with_context
+from rag_pipeline import (
+    index_markdown,
+    answer_with_context,
+    embedding_cache_stats,
+    is_model_loaded,
+    open_store,
+    prepare_answer,
+    stream_llm,
+    warm_up,
+)
 
 app = FastAPI(title="Multimodal RAG Pipeline")
 
@@ -55,6 +67,30 @@ async def startup_event():
     print("🚀 FastAPI started")
     mode = check_ollama_mode()
     print(f"💡 Ollama is using: {mode} mode")
+    # モデルのロードとベクトルストアのオープンは裏で行い、起動（ヘルスチェック）を待たせない。
+    # 先にリクエストが来た場合は、そのリクエストが読み込みの完了を待つ
+    asyncio.get_running_loop().run_in_executor(None, warm_up_rag)
+
+
+def warm_up_rag():
+    try:
+        store = open_store()
+        print(f"📦 Vector store: {store['num_chunks']} chunks ({store['path'] or 'in-memory'}), "
+              f"opened in {store['open_ms']:.1f} ms")
+        timings = warm_up()
+        print(f"🔥 Embedding model ready: loaded in {timings['model_load_sec']:.1f} sec, "
+              f"first encode {timings['first_encode_sec']:.2f} sec")
+    except Exception as e:
+        print("⚠️ ウォームアップに失敗:", e)
+
+
+@app.get("/api/health")
+async def health():
+    """
+    ヘルスチェック（モデルのロードを待たずに返す）。
+    - model_loaded: 埋め込みモデルのロードが済んでいるか
+    """
+    return {"status": "ok", "model_loaded": is_model_loaded()}
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -76,6 +112,7 @@ async def analyze(file: UploadFile = File(...)):
     - exec_time_sec: VLM実行時間
     - source_id: ベクトルDBに保存したドキュメントID
     - num_chunks: 保存されたチャンク数
+    - added / updated / deleted: 同じファイル名で登録済みの内容との差分（追加・更新・削除したチャンク数）
     """
     start_time = time.time()
 
@@ -84,12 +121,15 @@ async def analyze(file: UploadFile = File(...)):
         tmp_path = Path(tmp.name)
         tmp.write(await file.read())
 
+    # VLM の呼び出しとベクトル化は同期処理（モデルのロード待ちもある）なので、
+    # イベントループ（/api/health など）を止めないようにスレッドで動かす
+    loop = asyncio.get_running_loop()
     try:
         # 1. VLMでMarkdown生成
-        md = analyze_image_with_ollama(tmp_path)
+        md = await loop.run_in_executor(None, analyze_image_with_ollama, tmp_path)
 
         # 2. そのままRAGに投入（source_idには元ファイル名を使う）
-        index_info = index_markdown(md, source_id=file.filename)
+        index_info = await loop.run_in_executor(None, lambda: index_markdown(md, source_id=file.filename))
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
     finally:
@@ -97,12 +137,18 @@ async def analyze(file: UploadFile = File(...)):
 
     exec_time = time.time() - start_time
     print(f"⏱️ VLM+Index Execution time: {exec_time:.2f} sec")
+    cache = embedding_cache_stats()
+    if cache is not None:
+        print(f"🗃️ Embedding cache: {cache['entries']} entries, hit rate {cache['hit_rate']:.1%}")
 
     return {
         "markdown": md,
         "exec_time_sec": exec_time,
         "source_id": index_info["source_id"],
         "num_chunks": index_info["num_chunks"],
+        "added": index_info["added"],
+        "updated": index_info["updated"],
+        "deleted": index_info["deleted"],
     }
 
 
@@ -111,6 +157,7 @@ async def analyze(file: UploadFile = File(...)):
 class QueryBody(BaseModel):
     question: str
     top_k: int = 5
+    token_budget: Optional[int] = None  # None なら rag_pipeline.CONTEXT_TOKEN_BUDGET
 
 
 @app.post("/api/query")
@@ -119,18 +166,77 @@ async def query_rag(body: QueryBody):
     RAG に質問するエンドポイント。
     - body.question: 質問文（日本語でOK）
     - body.top_k   : 取得するコンテキスト数（デフォルト5）
+    - body.token_budget: プロンプトに入れるコンテキストの上限 token 数（省略可）
 
     戻り値:
     - answer: LLMによる最終回答
     - contexts: 参照したチャンク（documents, metadatas）
+    - context_tokens: コンテキストの token 数（元の量・詰めた後・節約できた量）
     """
     try:
-        result = answer_with_context(body.question, k=body.top_k)
+        # 検索・LLM 呼び出しは同期処理なので、イベントループを止めないようにスレッドで動かす
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: answer_with_context(body.question, k=body.top_k, token_budget=body.token_budget))
+        tokens = result["context_tokens"]
+        print(f"✂️ Context: {tokens['packed_tokens']}/{tokens['original_tokens']} tokens "
+              f"(saved {tokens['saved_tokens']}, duplicates {tokens['duplicates']}, truncated {tokens['truncated']})")
         return result
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+def sse_event(event: str, data) -> str:
+    """Server-Sent Events の1イベント（data は JSON）"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/query/stream")
+async def query_rag_stream(body: QueryBody):
+    """
+    /api/query のストリーミング版（Server-Sent Events）。回答の生成を待たずに、届いた分から返す。
+    イベント:
+    - contexts: 参照したチャンク（documents, metadatas）と context_tokens（生成の前に1回）
+    - token   : 回答の断片 {"text": "..."}
+    - done    : {"ttft_ms": 最初の断片までの時間, "total_ms": 全体の時間}
+    - error   : {"error": "..."}
+    """
+    async def events():
+        start = time.perf_counter()
+        ttft_ms = None
+        try:
+            # 検索・埋め込みは同期処理なので、イベントループを止めないようにスレッドで動かす
+            prepared = await asyncio.get_running_loop().run_in_executor(
+                None, prepare_answer, body.question, body.top_k, body.token_budget)
+            yield sse_event("contexts", {
+                "contexts": prepared["contexts"],
+                "context_tokens": prepared["context_tokens"],
+            })
+            async for text in stream_llm(prepared["prompt"]):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                yield sse_event("token", {"text": text})
+            total_ms = (time.perf_counter() - start) * 1000
+            print(f"⏱️ Streaming answer: first token {ttft_ms or total_ms:.0f} ms, total {total_ms:.0f} ms")
+            yield sse_event("done", {"ttft_ms": ttft_ms, "total_ms": total_ms})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    # nginx などのプロキシにバッファリングさせない
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/embedding-cache")
+async def embedding_cache():
+    """
+    埋め込みキャッシュの状態（件数・ヒット数・ミス数・ヒット率）を返す。
+    """
+    stats = embedding_cache_stats()
+    if stats is None:
+        return {"enabled": False}
+    return {"enabled": True, **stats}
+
+
 # ========== 開発用: uvicorn から直接起動する場合 ==========
 
 if __name__ == "__main__":
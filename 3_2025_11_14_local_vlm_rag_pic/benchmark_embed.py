@@ -0,0 +1,58 @@
+"""
+チャンクのベクトル化スループット（chunks/sec）を比較する。
+
+  python benchmark_embed.py --chunks 512 --batch-sizes 1 8 32 64
+
+- per-chunk: 従来の index_markdown と同じく、チャンクごとに embed_text を呼ぶ
+- batched  : embed_texts でまとめてベクトル化（batch_size ごとの順伝播）
+
+モデルの計算精度は rag_pipeline.EMBED_DTYPE で変えられる（CPU では float32 が速い）。
+埋め込みキャッシュは使わずに、モデルの計算だけを測る。
+"""
+import argparse
+import time
+
+import numpy as np
+
+import rag_pipeline
+
+
+def make_chunks(num_chunks, seed=0):
+    """長さがばらついた日本語の Markdown チャンクを作る（実文書の段落くらいの長さ）"""
+    rng = np.random.default_rng(seed)
+    words = ["会議", "議事録", "売上", "予算", "計画", "図", "表", "担当者", "期限", "課題",
+             "対応", "確認", "報告", "製品", "顧客", "品質", "工程", "改善", "資料", "承認"]
+    chunks = []
+    for _ in range(num_chunks):
+        n = int(rng.integers(20, 200))
+        chunks.append("- " + "、".join(rng.choice(words, size=n)) + "。")
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding throughput: per-chunk vs batched")
+    parser.add_argument("--chunks", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks, args.seed)
+    rag_pipeline.embed_texts(chunks[:8], use_cache=False)  # ウォームアップ
+
+    start = time.perf_counter()
+    expected = np.array([rag_pipeline.embed_text(c, use_cache=False) for c in chunks], dtype=np.float32)
+    per_chunk = time.perf_counter() - start
+    print(f"per-chunk            : {args.chunks / per_chunk:8.1f} chunks/s")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        embeddings = rag_pipeline.embed_texts(chunks, batch_size=batch_size, use_cache=False)
+        elapsed = time.perf_counter() - start
+        # バッチ内のパディングで値がわずかに変わることがあるので、cosine 類似度で確かめる
+        agreement = float(np.min(np.sum(embeddings * expected, axis=1)))
+        print(f"batched (batch={batch_size:>3}) : {args.chunks / elapsed:8.1f} chunks/s "
+              f"({per_chunk / elapsed:.1f}x, min cosine vs per-chunk {agreement:.4f})")
+
+
+if __name__ == "__main__":
+    main()
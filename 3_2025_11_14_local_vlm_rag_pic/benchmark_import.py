@@ -0,0 +1,54 @@
+"""
+import にかかる時間と、初回利用（モデルのロード）までの時間を測る。
+
+  python benchmark_import.py --repeat 5
+
+それぞれ新しいプロセスで測る:
+- import rag_pipeline / import app_full: モデルとベクトルストアは読み込まない
+- warm_up(): 埋め込みモデルのロード + ベクトルストアのオープン + 初回の encode
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+_IMPORT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_WARM_UP = """
+import json, time
+start = time.perf_counter()
+import rag_pipeline
+timings = rag_pipeline.warm_up()
+timings["total_sec"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def run(code):
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return out.stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of rag_pipeline / app_full and first-use warm-up")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-warm-up", action="store_true", help="モデルのロードは測らない")
+    args = parser.parse_args()
+
+    for module in ("rag_pipeline", "app_full"):
+        times = sorted(float(run(_IMPORT.format(module=module))) for _ in range(args.repeat))
+        print(f"import {module:<12}: median {times[len(times) // 2] * 1000:8.1f} ms "
+              f"(min {times[0] * 1000:.1f} ms, {args.repeat} runs)")
+
+    if not args.skip_warm_up:
+        timings = json.loads(run(_WARM_UP))
+        print("warm_up()            : " + ", ".join(f"{k} {v:.2f}" for k, v in timings.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Sequence, Tuple
+import base64
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import threading
+import unicodedata
 import uuid
 
-import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import requests
 
+# chromadb / sentence_transformers（torch）は import だけで数秒かかるので、初めて使うときに読み込む
+
 # ================================
 # 1. Markdown → chunk 分割
 # ================================
@@ -45,77 +54,656 @@ def split_markdown(md: str) -> List[Dict[str, str]]:
 # 2. Embedding モデル（bge-m3）
 # ================================
 
-# NOTE: 初回ロードは数秒かかります
-_EMBEDDER = SentenceTransformer("BAAI/bge-m3")
+EMBED_MODEL_NAME = "BAAI/bge-m3"
+EMBED_BATCH_SIZE = 32       # 1回の順伝播にまとめるチャンク数（CPU なら 16〜64 程度）
+EMBED_DTYPE = "float32"     # モデルの計算精度。GPU なら "float16" / "bfloat16" で高速化
+
+EMBED_CACHE_PATH: Optional[str] = "embedding_cache.sqlite3"  # None でキャッシュしない
+EMBED_CACHE_MAX_QUERIES = 10000  # キャッシュに残すクエリのベクトル数（古く使われていないものから消す）
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def _get_embedder():
+    """埋め込みモデル（初回だけロード。複数スレッドから同時に呼ばれても1回だけ）"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                from sentence_transformers import SentenceTransformer
+
+                # NOTE: 初回ロードは数秒かかります
+                _embedder = SentenceTransformer(EMBED_MODEL_NAME, model_kwargs={"torch_dtype": EMBED_DTYPE})
+    return _embedder
+
+
+def _normalize_text(text: str) -> str:
+    # 全角/半角などの表記ゆれ（NFKC）と空白の違いは同じテキストとみなす
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """
+    ベクトルの永続キャッシュ（SQLite）。
+    キーは「モデル名・精度 + 正規化したテキスト」の SHA-256 なので、同じ内容のチャンクや
+    同じクエリは、再登録・再起動の後でもモデルを通さずに済む（モデルにも正規化したテキストを通す）。
+    チャンクのベクトルは消さず、クエリのベクトルは max_queries 件を超えたら最後に使った時刻の古いものから消す。
+    """
+
+    def __init__(self, path: str, model_name: str, max_queries: Optional[int] = None):
+        self.path = path
+        self.model_name = model_name
+        self.max_queries = EMBED_CACHE_MAX_QUERIES if max_queries is None else max_queries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # 複数ワーカーからの読み書き
+        self._conn.execute("PRAGMA mmap_size=268435456")  # 読み出しはメモリマップ経由
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        # kind: "chunk" / "query"、last_used: 最後に使った時刻（クエリを古い順に消すため）
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")}
+        if "kind" not in columns:
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN kind TEXT NOT NULL DEFAULT 'chunk'")
+        if "last_used" not in columns:
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_kind_last_used ON embeddings (kind, last_used)")
+        self._conn.commit()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{_normalize_text(text)}".encode("utf-8")).digest()
+
+    def get_many(self, keys: Sequence[bytes], kind: str = "chunk") -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            # SQLite のプレースホルダ数の上限（古い版は 999）を超えないように分ける
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    part,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+                # 使った時刻を更新する。チャンクとして使われたクエリのベクトルは消さないようにチャンク扱いにする
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_used = ?, kind = CASE WHEN ? = 'chunk' THEN 'chunk' ELSE kind END "
+                    f"WHERE key IN ({placeholders})",
+                    [now, kind, *part],
+                )
+            self._conn.commit()
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items: Dict[bytes, np.ndarray], kind: str = "chunk") -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, kind, last_used) VALUES (?, ?, ?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes(), kind, now) for k, v in items.items()],
+            )
+            if kind == "query":
+                excess = self._conn.execute(
+                    "SELECT COUNT(*) FROM embeddings WHERE kind = 'query'"
+                ).fetchone()[0] - self.max_queries
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings WHERE kind = 'query' ORDER BY last_used LIMIT ?)",
+                        (excess,),
+                    )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            queries = self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE kind = 'query'").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "query_entries": queries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_embed_cache: Optional[EmbeddingCache] = None
+_embed_cache_lock = threading.Lock()
+
+
+def _get_embed_cache() -> Optional[EmbeddingCache]:
+    """埋め込みキャッシュ（初回だけ開く。EMBED_CACHE_PATH が None なら None）"""
+    global _embed_cache
+    if _embed_cache is None and EMBED_CACHE_PATH:
+        with _embed_cache_lock:
+            if _embed_cache is None:
+                _embed_cache = EmbeddingCache(EMBED_CACHE_PATH, f"{EMBED_MODEL_NAME}:{EMBED_DTYPE}")
+    return _embed_cache
+
+
+def embed_text(text: str, use_cache: bool = True, kind: str = "query"):
+    """テキスト（デフォルトはクエリ）をベクトル（np.ndarray, float32）に変換"""
+    return embed_texts([text], use_cache=use_cache, kind=kind)[0]
+
+
+def embed_texts(
+    texts: Sequence[str],
+    batch_size: Optional[int] = None,
+    use_cache: bool = True,
+    kind: str = "chunk",
+) -> np.ndarray:
+    """
+    複数のテキストをまとめてベクトル化する（shape: (件数, 次元), float32）。
+    キャッシュにあるものは読み出し、残りだけを batch_size 件ごとの順伝播でまとめて計算する
+    （チャンクごとの呼び出しのオーバーヘッドがかからない）。
+    全部キャッシュにあれば（空の入力も）モデルはロードしない。空の入力には shape (0, 0) を返す。
+    モデルにはキャッシュのキーと同じ正規化（NFKC・空白の統一）をしたテキストを通すので、
+    キャッシュの有無や表記ゆれで結果が変わらない。kind="query" のベクトルはキャッシュの上限の対象。
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    cache = _get_embed_cache() if use_cache else None
+    if cache is None:
+        return _encode([_normalize_text(t) for t in texts], batch_size)
+
+    keys = [cache.key(t) for t in texts]
+    cached = cache.get_many(keys, kind=kind)
+    # キャッシュにないテキストだけを（同じ内容は1回だけ）モデルに通す
+    missing: Dict[bytes, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = _normalize_text(text)
+    if missing:
+        computed = dict(zip(missing, _encode(list(missing.values()), batch_size)))
+        cache.put_many(computed, kind=kind)
+        cached.update(computed)
+
+    # 次元はモデルに聞かず、ベクトルから取る（キャッシュだけで済むときにモデルをロードしない）
+    embeddings = np.empty((len(texts), len(cached[keys[0]])), dtype=np.float32)
+    for i, key in enumerate(keys):
+        embeddings[i] = cached[key]
+    return embeddings
+
+
+def _encode(texts: List[str], batch_size: Optional[int]) -> np.ndarray:
+    embeddings = _get_embedder().encode(
+        texts,
+        batch_size=batch_size or EMBED_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+    )
+    return embeddings.astype(np.float32, copy=False)
+
 
-def embed_text(text: str):
-    """テキストをベクトル（list[float]）に変換"""
-    return _EMBEDDER.encode(text, normalize_embeddings=True)
+def embedding_cache_stats() -> Optional[Dict[str, Any]]:
+    """埋め込みキャッシュの件数とヒット率（キャッシュ無効なら None）"""
+    cache = _get_embed_cache()
+    return cache.stats() if cache is not None else None
 
 
 # ================================
 # 3. ChromaDB セットアップ
 # ================================
 
-_client = chromadb.Client()
-_collection = _client.get_or_create_collection(
-    name="docs",
-    metadata={"hnsw:space": "cosine"},
-)
+CHROMA_PATH: Optional[str] = "chroma_db"  # None ならメモリ上だけ（再起動で消える）
+COLLECTION_NAME = "docs"
+
+_collection = None
+_collection_lock = threading.Lock()
 
 
-def index_markdown(md: str, source_id: Optional[str] = None) -> Dict[str, Any]:
+def _get_collection():
+    """ChromaDB のコレクション（初回だけ開く。複数スレッドから同時に呼ばれても1回だけ）"""
+    global _collection
+    if _collection is None:
+        with _collection_lock:
+            if _collection is None:
+                import chromadb
+
+                # 永続モードでは SQLite + HNSW のセグメントファイルとしてディスクに保存され、
+                # 再起動しても VLM の解析・ベクトル化をやり直さずにそのまま開ける
+                client = chromadb.PersistentClient(path=CHROMA_PATH) if CHROMA_PATH else chromadb.Client()
+                _collection = client.get_or_create_collection(
+                    name=COLLECTION_NAME,
+                    metadata={"hnsw:space": "cosine"},
+                )
+    return _collection
+
+
+def open_store() -> Dict[str, Any]:
+    """
+    ベクトルストアを開いて件数を数える（FastAPI の起動時に呼ぶ）。
+    戻り値: {"path": str | None, "num_chunks": int, "open_ms": float}
+    """
+    start = time.perf_counter()
+    num_chunks = _get_collection().count()
+    return {
+        "path": CHROMA_PATH,
+        "num_chunks": num_chunks,
+        "open_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    モデル・キャッシュ・ベクトルストアを読み込み、1回ベクトル化しておく（FastAPI の起動時にバックグラウンドで呼ぶ）。
+    戻り値: 各ステップの所要時間（秒）
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    _get_embedder()
+    timings["model_load_sec"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _get_embed_cache()
+    _get_collection()
+    _get_sparse_index()
+    timings["store_open_sec"] = time.perf_counter() - start
+
+    # 初回の encode はスレッドプールや計算グラフの準備で遅いので、ここで済ませておく
+    start = time.perf_counter()
+    embed_texts(["warm-up"], use_cache=False)
+    timings["first_encode_sec"] = time.perf_counter() - start
+    return timings
+
+
+def is_model_loaded() -> bool:
+    """埋め込みモデルがロード済みか（ヘルスチェック用。ロードはしない）"""
+    return _embedder is not None
+
+
+def export_collection(path: str, page_size: int = 1000) -> int:
+    """
+    コレクションの全チャンクを JSONL に書き出す（1行1チャンク）。
+    {"id", "document", "metadata", "embedding": float32 リトルエンディアンの base64}
+    ベクトルも含むので、import_collection で別のマシン・ワーカーにそのまま読み込める。
+    戻り値: 書き出したチャンク数
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        offset = 0
+        while True:
+            page = _get_collection().get(
+                limit=page_size,
+                offset=offset,
+                include=["documents", "metadatas", "embeddings"],
+            )
+            if not page["ids"]:
+                break
+            for chunk_id, document, metadata, embedding in zip(
+                page["ids"], page["documents"], page["metadatas"], page["embeddings"]
+            ):
+                vector = np.asarray(embedding, dtype="<f4")
+                f.write(json.dumps({
+                    "id": chunk_id,
+                    "document": document,
+                    "metadata": metadata,
+                    "embedding": base64.b64encode(vector.tobytes()).decode("ascii"),
+                }, ensure_ascii=False) + "\n")
+            count += len(page["ids"])
+            offset += len(page["ids"])
+    return count
+
+
+def import_collection(path: str) -> int:
+    """
+    export_collection の JSONL を読み込む（同じIDは上書き）。モデルは通さない。
+    戻り値: 読み込んだチャンク数
+    """
+    count = 0
+    with open(path, encoding="utf-8") as f:
+        batch: List[Dict[str, Any]] = []
+        for line in f:
+            line = line.strip()
+            if line:
+                batch.append(json.loads(line))
+            if len(batch) == _ADD_BATCH_SIZE:
+                _upsert_records(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            _upsert_records(batch)
+            count += len(batch)
+    return count
+
+
+def _upsert_records(records: List[Dict[str, Any]]) -> None:
+    ids = [r["id"] for r in records]
+    documents = [r["document"] for r in records]
+    _get_collection().upsert(
+        ids=ids,
+        embeddings=[np.frombuffer(base64.b64decode(r["embedding"]), dtype="<f4") for r in records],
+        documents=documents,
+        metadatas=[r["metadata"] for r in records],
+    )
+    _get_sparse_index().upsert(ids, documents)
+
+
+# --------------------------------
+# BM25 の転置インデックス（SQLite FTS5）
+# --------------------------------
+
+SPARSE_INDEX_PATH: Optional[str] = "bm25_index.sqlite3"  # None ならメモリ上だけ
+
+# 英数字の語（型番の "AB-1234" などは記号ごと1語）と、ひらがな・カタカナ・漢字の連続
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[-_.][0-9a-z]+)*|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    BM25 用のトークン列。NFKC 正規化・小文字化したうえで、
+    - 英数字の語はそのまま（"ab-1234" のような型番は、記号で区切った部分も加える）
+    - 日本語は文字 bigram（形態素解析器なしで、部分一致の固有名詞・複合語も拾える）
+    """
+    tokens: List[str] = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        word = match.group()
+        if word[0].isascii():
+            tokens.append(word)
+            parts = re.split(r"[-_.]", word)
+            if len(parts) > 1:
+                tokens.extend(parts)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class SparseIndex:
+    """
+    チャンク本文の BM25 インデックス（SQLite FTS5 の bm25() で採点）。
+    本文は tokenize() のトークンを空白区切りにして入れるので、FTS5 側は空白で区切るだけ。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FTS5 の rowid とチャンクIDの対応（削除・上書きをIDで引くため）
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunk_ids (rowid INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL)")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunk_tokens USING fts5(tokens, tokenize=\"unicode61 tokenchars '-_.'\")"
+        )
+        self._conn.commit()
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[str]) -> None:
+        with self._lock:
+            for chunk_id, document in zip(ids, documents):
+                self._conn.execute("INSERT OR IGNORE INTO chunk_ids (id) VALUES (?)", (chunk_id,))
+                rowid = self._conn.execute("SELECT rowid FROM chunk_ids WHERE id = ?", (chunk_id,)).fetchone()[0]
+                self._conn.execute("DELETE FROM chunk_tokens WHERE rowid = ?", (rowid,))
+                self._conn.execute(
+                    "INSERT INTO chunk_tokens (rowid, tokens) VALUES (?, ?)", (rowid, " ".join(tokenize(document)))
+                )
+            self._conn.commit()
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            for chunk_id in ids:
+                row = self._conn.execute("SELECT rowid FROM chunk_ids WHERE id = ?", (chunk_id,)).fetchone()
+                if row is not None:
+                    self._conn.execute("DELETE FROM chunk_tokens WHERE rowid = ?", row)
+                    self._conn.execute("DELETE FROM chunk_ids WHERE rowid = ?", row)
+            self._conn.commit()
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """BM25 の高い順に (チャンクID, スコア) を返す"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        match = " OR ".join(f'"{t}"' for t in tokens)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_ids.id, bm25(chunk_tokens) FROM chunk_tokens "
+                "JOIN chunk_ids ON chunk_ids.rowid = chunk_tokens.rowid "
+                "WHERE chunk_tokens MATCH ? ORDER BY bm25(chunk_tokens) LIMIT ?",
+                (match, k),
+            ).fetchall()
+        # FTS5 の bm25() は小さいほど良い（符号を反転した値）
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunk_ids").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chunk_tokens")
+            self._conn.execute("DELETE FROM chunk_ids")
+            self._conn.commit()
+
+
+_sparse_index: Optional[SparseIndex] = None
+_sparse_index_lock = threading.Lock()
+
+
+def _get_sparse_index() -> SparseIndex:
+    """BM25 インデックス（初回だけ開く。件数がコレクションと合わなければ作り直す）"""
+    global _sparse_index
+    if _sparse_index is None:
+        with _sparse_index_lock:
+            if _sparse_index is None:
+                index = SparseIndex(SPARSE_INDEX_PATH or ":memory:")
+                # BM25 インデックスがない既存のコレクション（以前の版で作ったもの）にも対応する
+                if index.count() != _get_collection().count():
+                    rebuild_sparse_index(index)
+                _sparse_index = index
+    return _sparse_index
+
+
+def rebuild_sparse_index(index: Optional[SparseIndex] = None, page_size: int = 1000) -> int:
+    """コレクションの全チャンクから BM25 インデックスを作り直す。戻り値: チャンク数"""
+    index = index or _get_sparse_index()
+    index.clear()
+    count = 0
+    offset = 0
+    while True:
+        page = _get_collection().get(limit=page_size, offset=offset, include=["documents"])
+        if not page["ids"]:
+            break
+        index.upsert(page["ids"], page["documents"])
+        count += len(page["ids"])
+        offset += len(page["ids"])
+    return count
+
+
+# Chroma の add 1回あたりの最大件数（クライアントの上限より小さくしておく）
+_ADD_BATCH_SIZE = 4096
+
+
+def index_markdown(md: str, source_id: Optional[str] = None, upsert: bool = True) -> Dict[str, Any]:
     """
     Markdownをチャンク化してChromaDBに登録する。
     - source_id が与えられなければ自動生成する。
-    戻り値: {"source_id": str, "num_chunks": int}
+    - upsert=True なら、同じ source_id で登録済みのチャンクとの差分だけを書き込む（index_documents 参照）。
+    戻り値: {"source_id": str, "num_chunks": int, "added": int, "updated": int, "deleted": int, "unchanged": int}
     """
-    if source_id is None or not source_id.strip():
-        source_id = f"doc_{uuid.uuid4().hex[:8]}"
+    return index_documents([(md, source_id)], upsert=upsert)[0]
 
-    chunks = split_markdown(md)
 
-    ids = []
-    embeddings = []
-    documents = []
-    metadatas = []
+def index_documents(
+    docs: Sequence[Tuple[str, Optional[str]]],
+    batch_size: Optional[int] = None,
+    upsert: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    複数の Markdown（(md, source_id) のリスト）をまとめて登録する。
+    追加するチャンクは全ドキュメント分を1つのリストにしてバッチでベクトル化し、ChromaDB にもまとめて書き込む。
+
+    upsert=True（デフォルト）では、チャンクIDを「source_id + 本文のハッシュ」にして、
+    その source_id で登録済みのチャンクと突き合わせる:
+      - 新しい本文のチャンクだけをベクトル化して追加する
+      - 見出しや位置だけが変わったチャンクはメタデータだけを更新する
+      - なくなったチャンクは削除する
+    同じドキュメントを何度登録しても結果は同じで、更新のコストは変わった分だけで済む。
+    upsert=False は従来どおり `{source_id}_{チャンク番号}` で追加するだけ。
+
+    戻り値: ドキュメントごとの {"source_id", "num_chunks", "added", "updated", "deleted", "unchanged"}
+    """
+    add_ids: List[str] = []
+    add_documents: List[str] = []
+    add_metadatas: List[Dict[str, Any]] = []
+    update_ids: List[str] = []
+    update_metadatas: List[Dict[str, Any]] = []
+    delete_ids: List[str] = []
+    results = []
+    seen_sources = set()
+
+    for md, source_id in docs:
+        if source_id is None or not source_id.strip():
+            source_id = f"doc_{uuid.uuid4().hex[:8]}"
+        if source_id in seen_sources:
+            raise ValueError(f"source_id {source_id!r} is given more than once")
+        seen_sources.add(source_id)
+
+        chunks = _chunk_records(md, source_id, upsert)
+        existing: Dict[str, Dict[str, Any]] = {}
+        if upsert:
+            stored = _get_collection().get(where={"source": source_id}, include=["metadatas"])
+            existing = dict(zip(stored["ids"], stored["metadatas"]))
+
+        added = updated = 0
+        for chunk_id, content, metadata in chunks:
+            if chunk_id not in existing:
+                add_ids.append(chunk_id)
+                add_documents.append(content)
+                add_metadatas.append(metadata)
+                added += 1
+            elif existing[chunk_id] != metadata:
+                update_ids.append(chunk_id)
+                update_metadatas.append(metadata)
+                updated += 1
+
+        chunk_ids = {chunk_id for chunk_id, _, _ in chunks}
+        stale = [chunk_id for chunk_id in existing if chunk_id not in chunk_ids]
+        delete_ids.extend(stale)
+        results.append({
+            "source_id": source_id,
+            "num_chunks": len(chunks),
+            "added": added,
+            "updated": updated,
+            "deleted": len(stale),
+            "unchanged": len(chunks) - added - updated,
+        })
 
-    for i, ch in enumerate(chunks):
+    # ベクトル化（失敗しやすい）を先に済ませ、削除は最後に行う。途中で失敗しても
+    # 登録済みの版は消えずに残る（中途半端に消えた状態にならない）
+    embeddings = embed_texts(add_documents, batch_size=batch_size)
+
+    sparse_index = _get_sparse_index()
+    for start in range(0, len(add_ids), _ADD_BATCH_SIZE):
+        end = start + _ADD_BATCH_SIZE
+        _get_collection().add(
+            ids=add_ids[start:end],
+            embeddings=list(embeddings[start:end]),
+            documents=add_documents[start:end],
+            metadatas=add_metadatas[start:end],
+        )
+    sparse_index.upsert(add_ids, add_documents)
+
+    for start in range(0, len(update_ids), _ADD_BATCH_SIZE):
+        end = start + _ADD_BATCH_SIZE
+        _get_collection().update(ids=update_ids[start:end], metadatas=update_metadatas[start:end])
+
+    for start in range(0, len(delete_ids), _ADD_BATCH_SIZE):
+        _get_collection().delete(ids=delete_ids[start:start + _ADD_BATCH_SIZE])
+    sparse_index.delete(delete_ids)
+
+    return results
+
+
+def _chunk_records(md: str, source_id: str, upsert: bool) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Markdown を (チャンクID, 本文, メタデータ) のリストにする"""
+    records: List[Tuple[str, str, Dict[str, Any]]] = []
+    occurrences: Dict[str, int] = {}
+
+    for i, ch in enumerate(split_markdown(md)):
         content = ch["content"].strip()
         if not content:
             continue
 
-        emb = embed_text(content)
-        ids.append(f"{source_id}_{i}")
-        embeddings.append(emb)
-        documents.append(content)
-        metadatas.append({
+        metadata: Dict[str, Any] = {
             "title": ch["title"],
             "source": source_id,
-        })
+        }
+        if upsert:
+            # 本文が同じなら同じID（同じ本文が複数あれば2つ目から連番を付ける）
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+            n = occurrences.get(digest, 0)
+            occurrences[digest] = n + 1
+            chunk_id = f"{source_id}_{digest}" if n == 0 else f"{source_id}_{digest}_{n}"
+            metadata["position"] = len(records)
+        else:
+            chunk_id = f"{source_id}_{i}"
+        records.append((chunk_id, content, metadata))
+
+    return records
 
-    if ids:
-        _collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas,
-        )
 
-    return {"source_id": source_id, "num_chunks": len(ids)}
+HYBRID_CANDIDATES = 20  # ハイブリッド検索で dense / BM25 のそれぞれから取る候補数
+RRF_K = 60              # Reciprocal Rank Fusion の定数（順位 r の重みは 1 / (RRF_K + r)）
 
 
-def search(query: str, k: int = 5) -> Dict[str, Any]:
+def search(query: str, k: int = 5, mode: str = "hybrid") -> Dict[str, Any]:
     """
-    ユーザクエリを埋め込み、近傍チャンクを検索する。
-    ChromaDB の生の query 結果を返す。
+    ユーザクエリに近いチャンクを検索する。
+    - mode="dense" : クエリを埋め込んで ChromaDB で近傍検索（ChromaDB の生の query 結果を返す）
+    - mode="hybrid": dense と BM25（型番・固有名詞などの完全一致に強い）の上位候補を
+                     Reciprocal Rank Fusion で統合し、上位k件を返す
+    戻り値は ChromaDB の query 結果と同じ形（{"ids": [[...]], "documents": [[...]], "metadatas": [[...]]}）。
+    hybrid では "distances" の代わりに RRF のスコア "scores" が入る。
     """
+    if mode not in ("dense", "hybrid"):
+        raise ValueError(f"Unknown search mode: {mode} (choose from dense, hybrid)")
+
     q_emb = embed_text(query)
-    results = _collection.query(
+    if mode == "dense":
+        return _get_collection().query(
+            query_embeddings=[q_emb],
+            n_results=k,
+        )
+
+    num_candidates = max(k, HYBRID_CANDIDATES)
+    dense = _get_collection().query(
         query_embeddings=[q_emb],
-        n_results=k,
+        n_results=num_candidates,
+        include=["documents", "metadatas"],
     )
-    return results
+    sparse = _get_sparse_index().search(query, num_candidates)
+
+    scores: Dict[str, float] = {}
+    for ranking in (dense["ids"][0], [chunk_id for chunk_id, _ in sparse]):
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+    top_ids = sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)[:k]
+
+    # BM25 だけで見つかったチャンクの本文とメタデータを取りに行く
+    found = dict(zip(dense["ids"][0], zip(dense["documents"][0], dense["metadatas"][0])))
+    missing = [chunk_id for chunk_id in top_ids if chunk_id not in found]
+    if missing:
+        extra = _get_collection().get(ids=missing, include=["documents", "metadatas"])
+        found.update(zip(extra["ids"], zip(extra["documents"], extra["metadatas"])))
+    top_ids = [chunk_id for chunk_id in top_ids if chunk_id in found]
+
+    return {
+        "ids": [top_ids],
+        "documents": [[found[chunk_id][0] for chunk_id in top_ids]],
+        "metadatas": [[found[chunk_id][1] for chunk_id in top_ids]],
+        "scores": [[scores[chunk_id] for chunk_id in top_ids]],
+    }
 
 
 # ================================
@@ -141,23 +729,162 @@ def call_llm(prompt: str) -> str:
     return data.get("response", "").strip()
 
 
-def answer_with_context(query: str, k: int = 5) -> Dict[str, Any]:
+async def stream_llm(prompt: str) -> AsyncIterator[str]:
+    """
+    Ollama の /api/generate をストリーミング（"stream": True）で叩き、生成されたテキストを断片ごとに返す。
+    Ollama は1行1つの JSON（{"response": "...", "done": false}）を返すので、届いた行から順に流す。
+    """
+    import httpx
+
+    payload = {
+        "model": LLM_MODEL_NAME,
+        "prompt": prompt,
+        "stream": True,
+    }
+    # 生成全体には時間がかかるので、読み出しの待ち時間だけを制限する（トークン間の間隔）
+    timeout = httpx.Timeout(10.0, read=600.0)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async with client.stream("POST", OLLAMA_API_URL, json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    break
+
+
+# --------------------------------
+# コンテキストの詰め込み（token 予算）
+# --------------------------------
+
+CONTEXT_TOKEN_BUDGET = 2048     # プロンプトに入れるコンテキストの上限 token 数（見出し行を含む）
+CONTEXT_DEDUP_OVERLAP = 0.8     # 採用済みのチャンクとトークンがこの割合以上重なるチャンクは入れない
+CONTEXT_MIN_CHUNK_TOKENS = 64   # 予算の残りがこれ以上あれば、入りきらないチャンクを切り詰めて入れる
+# gpt-oss の tokenizer（o200k_harmony）は o200k_base に特殊トークンを足したもの。本文の token 数は同じ
+LLM_TOKENIZER_ENCODING = "o200k_base"
+
+_llm_tokenizer: Optional[Tuple[Callable[[str], List[int]], Callable[[List[int]], str]]] = None
+_llm_tokenizer_lock = threading.Lock()
+
+
+def _get_llm_tokenizer() -> Tuple[Callable[[str], List[int]], Callable[[List[int]], str]]:
+    """
+    LLM の tokenizer の (encode, decode)。tiktoken がない・読み込めない（オフラインで BPE のファイルを
+    取得できないなど）ときは埋め込みモデルの tokenizer で近似する。
+    """
+    global _llm_tokenizer
+    if _llm_tokenizer is None:
+        with _llm_tokenizer_lock:
+            if _llm_tokenizer is None:
+                try:
+                    import tiktoken
+
+                    # 初回は BPE のファイルをダウンロードするので、オフラインの環境ではここで失敗する
+                    encoding = tiktoken.get_encoding(LLM_TOKENIZER_ENCODING)
+                    _llm_tokenizer = (encoding.encode_ordinary, encoding.decode)
+                except Exception as e:
+                    if not isinstance(e, ImportError):
+                        print(f"⚠️ tiktoken の {LLM_TOKENIZER_ENCODING} を読み込めないので、埋め込みモデルの tokenizer で数えます: {e}")
+                    tokenizer = _get_embedder().tokenizer
+                    _llm_tokenizer = (
+                        lambda text: tokenizer.encode(text, add_special_tokens=False),
+                        lambda ids: tokenizer.decode(ids, skip_special_tokens=True),
+                    )
+    return _llm_tokenizer
+
+
+def _format_context(i: int, doc: str, meta: Dict[str, Any]) -> str:
+    title = meta.get("title") or ""
+    source = meta.get("source") or ""
+    header = f"[{i}] source={source} title={title}".strip()
+    return f"{header}\n{doc}\n\n"
+
+
+def pack_context(
+    docs: Sequence[str],
+    metadatas: Sequence[Dict[str, Any]],
+    token_budget: Optional[int] = None,
+) -> Tuple[str, List[str], List[Dict[str, Any]], Dict[str, int]]:
+    """
+    検索結果（関連度の高い順）をプロンプト用のコンテキストに詰める。
+    - 上位のチャンクと内容が重なるチャンク（同じ文書の再登録、前後で重複する節など）は除く
+    - 関連度の高い順に token_budget（デフォルト CONTEXT_TOKEN_BUDGET）まで入れる。
+      入りきらないチャンクは、残りが CONTEXT_MIN_CHUNK_TOKENS 以上なら切り詰めて入れ、
+      それ未満なら飛ばして次の（短い）チャンクを試す
+    戻り値: (context_block, 入れたチャンク, そのメタデータ, token 数のレポート)
+    """
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    encode, decode = _get_llm_tokenizer()
+
+    original_tokens = sum(len(encode(_format_context(i, d, m))) for i, (d, m) in enumerate(zip(docs, metadatas), 1))
+
+    kept_tokens: List[set] = []
+    packed_docs: List[str] = []
+    packed_metas: List[Dict[str, Any]] = []
+    context_block = ""
+    used = duplicates = truncated = dropped = 0
+    for doc, meta in zip(docs, metadatas):
+        tokens = set(tokenize(doc)) or {" ".join(unicodedata.normalize("NFKC", doc).split())}
+        if any(len(tokens & kept) >= CONTEXT_DEDUP_OVERLAP * len(tokens) for kept in kept_tokens):
+            duplicates += 1
+            continue
+
+        entry = _format_context(len(packed_docs) + 1, doc, meta)
+        n = len(encode(entry))
+        if used + n > budget:
+            overhead = n - len(encode(doc))  # 見出し行と区切りの分
+            room = budget - used - overhead
+            ids = encode(doc)
+            while room >= CONTEXT_MIN_CHUNK_TOKENS:
+                head = decode(ids[:room]).rstrip()
+                entry = _format_context(len(packed_docs) + 1, head, meta)
+                n = len(encode(entry))
+                if used + n <= budget:
+                    break
+                # 切り口で token の区切りが変わって超えた分だけ詰める
+                room = max(0, room - (used + n - budget))
+            if room < CONTEXT_MIN_CHUNK_TOKENS:
+                dropped += 1
+                continue
+            doc = head
+            truncated += 1
+
+        kept_tokens.append(tokens)
+        packed_docs.append(doc)
+        packed_metas.append(meta)
+        context_block += entry
+        used += n
+
+    report = {
+        "budget": budget,
+        "original_tokens": original_tokens,
+        "packed_tokens": used,
+        "saved_tokens": original_tokens - used,
+        "duplicates": duplicates,
+        "truncated": truncated,
+        "dropped": dropped,
+    }
+    return context_block, packed_docs, packed_metas, report
+
+
+def prepare_answer(query: str, k: int = 5, token_budget: Optional[int] = None) -> Dict[str, Any]:
     """
     - クエリで ChromaDB から上位k件を取得
-    - それらをコンテキストとして LLM に投げる
-    - 回答と、参照したコンテキストをまとめて返す
+    - 重複を除き、token 予算に収まるように詰めて（pack_context）LLM 用のプロンプトを作る
+    戻り値: {"prompt", "contexts": {"documents", "metadatas"}, "context_tokens"}
+    （answer_with_context と、ストリーミングで回答する /api/query/stream で共通）
     """
     ctx = search(query, k=k)
     docs = ctx.get("documents", [[]])[0]
     metadatas = ctx.get("metadatas", [[]])[0]
 
     # コンテキストをLLMに渡すためのテキストに整形
-    context_block = ""
-    for i, (doc, meta) in enumerate(zip(docs, metadatas), start=1):
-        title = meta.get("title") or ""
-        source = meta.get("source") or ""
-        header = f"[{i}] source={source} title={title}".strip()
-        context_block += f"{header}\n{doc}\n\n"
+    context_block, docs, metadatas, context_tokens = pack_context(docs, metadatas, token_budget)
 
     prompt = f"""
 あなたはRAGシステムの回答エンジンです。
@@ -171,12 +898,46 @@ def answer_with_context(query: str, k: int = 5) -> Dict[str, Any]:
 {context_block}
 """
 
-    answer = call_llm(prompt)
-
     return {
-        "answer": answer,
+        "prompt": prompt,
         "contexts": {
             "documents": docs,
             "metadatas": metadatas,
         },
-    }
\ No newline at end of file
+        "context_tokens": context_tokens,
+    }
+
+
+def answer_with_context(query: str, k: int = 5, token_budget: Optional[int] = None) -> Dict[str, Any]:
+    """
+    - prepare_answer でプロンプトを作って LLM に投げる
+    - 回答と、参照したコンテキスト、節約できたプロンプトの token 数をまとめて返す
+    """
+    prepared = prepare_answer(query, k=k, token_budget=token_budget)
+    answer = call_llm(prepared["prompt"])
+
+    return {
+        "answer": answer,
+        "contexts": prepared["contexts"],
+        "context_tokens": prepared["context_tokens"],
+    }
+
+
+# ================================
+# 5. コレクションの書き出し / 読み込み
+# ================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export / import the Chroma collection as JSONL")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="JSONL ファイル")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        n = export_collection(args.path)
+    else:
+        n = import_collection(args.path)
+    print(f"{args.command}: {n} chunks ({args.path}) in {time.perf_counter() - start:.1f} sec")
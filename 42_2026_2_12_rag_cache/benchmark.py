@@ -0,0 +1,195 @@
+"""
+Benchmarks for RAGCacheSimulator.
+
+  # 追い出しのスループット
+  python benchmark.py --accesses 1000000 --baseline-accesses 5000
+
+  # Knowledge Tree のメモリ使用量（ノード数ごと）
+  python benchmark.py --memory 1000000 10000000
+
+  # スナップショットの保存 / 復元時間（再生したアクセス数ごと）
+  python benchmark.py --snapshot 1000000 5000000
+
+"before" は従来の DFS + min() による追い出し（追い出しごとに木全体を走査）、
+"after" は GPU 上の葉だけを積んだヒープによる追い出し。
+メモリは従来の __dict__ ベースの Node と、__slots__ + ID共有の Node を比較する。
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import Node, RAGCacheSimulator
+from snapshot import load_snapshot, save_snapshot
+from traces import synthetic_trace, take_accesses
+
+
+class DictNode:
+    """The original Node layout: per-instance __dict__ and an eager children dict."""
+
+    def __init__(self, doc_id, parent=None, size=100, cost=10):
+        self.doc_id = doc_id
+        self.parent = parent
+        self.children = {}
+        self.size = size
+        self.cost = cost
+        self.frequency = 0
+        self.priority = 0.0
+        self.location = "DISK"
+        self.last_access = 0
+        self.gpu_children = 0
+        self.host_children = 0
+        self.heap_version = 0
+
+    def add_child(self, child):
+        self.children[child.doc_id] = child
+        return child
+
+    def get_child(self, doc_id):
+        return self.children.get(doc_id)
+
+
+class ScanEvictionSimulator(RAGCacheSimulator):
+    """The original O(#nodes) eviction: full DFS, leaf filtering and a linear min()."""
+
+    def _evict_from_gpu(self):
+        stack = [self.root]
+        gpu_nodes = []
+        while stack:
+            n = stack.pop()
+            if n.location == "GPU" and n != self.root:
+                gpu_nodes.append(n)
+            for child in n.children.values():
+                stack.append(child)
+
+        if not gpu_nodes:
+            return False
+
+        leaf_candidates = [n for n in gpu_nodes if all(c.location != "GPU" for c in n.children.values())]
+        if not leaf_candidates:
+            leaf_candidates = gpu_nodes
+
+        victim = min(leaf_candidates, key=lambda x: x.priority)
+        self._demote_from_gpu(victim)
+        return True
+
+
+def replay(sim_cls, args, num_accesses):
+    sim = sim_cls(gpu_capacity=args.gpu_capacity, host_capacity=args.host_capacity, verbose=False)
+    trace = take_accesses(
+        synthetic_trace(num_accesses, num_docs=args.num_docs, seed=args.seed),
+        num_accesses,
+    )
+
+    accesses = 0
+    start = time.perf_counter()
+    for seq in trace:
+        sim.access_sequence(seq)
+        accesses += len(seq)
+    elapsed = time.perf_counter() - start
+    return accesses, elapsed
+
+
+def _max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux は KiB 単位
+
+
+def build_tree(node_cls, num_nodes, num_docs, seed):
+    """Builds a random prefix tree of num_nodes nodes and returns bytes of RSS growth per node."""
+    rng = random.Random(seed)
+    # アクセスごとの状態を持つ木に近づけるため、priority/last_access も実値を入れる
+    nodes = [None] * (num_nodes + 1)
+    rss_before = _max_rss_bytes()
+
+    nodes[0] = root = node_cls("ROOT", size=10, cost=1)
+    for i in range(1, num_nodes + 1):
+        parent = nodes[rng.randrange(i)] if i > 16 else root
+        # 同じ親の下に同じ doc_id は1つだけ（シミュレータと同じく、既にあれば引き直す）
+        doc_id = f"D{rng.randrange(num_docs)}"
+        while parent.get_child(doc_id) is not None:
+            doc_id = f"D{rng.randrange(num_docs)}"
+        node = node_cls(doc_id, parent=parent)
+        node.frequency = 1
+        node.priority = rng.random()
+        node.last_access = i
+        parent.add_child(node)
+        nodes[i] = node
+
+    return (_max_rss_bytes() - rss_before) / num_nodes
+
+
+def memory_benchmark(args):
+    for num_nodes in args.memory:
+        for label, node_cls in [("before (dict Node)", DictNode), ("after  (slots Node)", Node)]:
+            # ノード数ごと・実装ごとに新しいプロセスで測り、ピークRSSの増分を比較する
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                per_node = pool.submit(build_tree, node_cls, num_nodes, args.num_docs, args.seed).result()
+            print(f"{num_nodes:>11,} nodes {label}: {per_node:6.1f} B/node, {per_node * num_nodes / 2**30:6.2f} GiB total")
+
+
+def _timed_load(path):
+    start = time.perf_counter()
+    sim = load_snapshot(path, verbose=False)
+    return time.perf_counter() - start, sim.report()
+
+
+def snapshot_benchmark(args):
+    for num_accesses in args.snapshot:
+        sim = RAGCacheSimulator(gpu_capacity=args.gpu_capacity, host_capacity=args.host_capacity, verbose=False)
+        trace = take_accesses(synthetic_trace(num_accesses, num_docs=args.num_docs, seed=args.seed), num_accesses)
+        for seq in trace:
+            sim.access_sequence(seq)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.snap")
+            start = time.perf_counter()
+            num_nodes = save_snapshot(sim, path)
+            save_sec = time.perf_counter() - start
+            file_bytes = os.path.getsize(path)
+
+            # 再起動を想定して、新しいプロセスで復元する
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                load_sec, report = pool.submit(_timed_load, path).result()
+
+        assert report == sim.report()
+        print(f"{num_nodes:>11,} nodes: {file_bytes / num_nodes:.1f} B/node, "
+              f"save {save_sec:.2f}s, load {load_sec:.2f}s ({load_sec / num_nodes * 1e6:.2f} us/node)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAGCacheSimulator eviction / memory benchmark")
+    parser.add_argument("--accesses", type=int, default=1_000_000)
+    parser.add_argument("--baseline-accesses", type=int, default=5_000,
+                        help="DFS版は二乗オーダーなので短いトレースで測る")
+    parser.add_argument("--num-docs", type=int, default=100_000)
+    parser.add_argument("--gpu-capacity", type=int, default=200_000)
+    parser.add_argument("--host-capacity", type=int, default=10**12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", type=int, nargs="+", metavar="NODES",
+                        help="指定したノード数で Knowledge Tree のメモリを測る")
+    parser.add_argument("--snapshot", type=int, nargs="+", metavar="ACCESSES",
+                        help="指定したアクセス数を再生した木でスナップショットの保存 / 復元時間を測る")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_benchmark(args)
+        return
+    if args.snapshot:
+        snapshot_benchmark(args)
+        return
+
+    for label, sim_cls, n in [
+        ("before (DFS scan)", ScanEvictionSimulator, args.baseline_accesses),
+        ("after  (heap)", RAGCacheSimulator, args.accesses),
+    ]:
+        accesses, elapsed = replay(sim_cls, args, n)
+        print(f"{label}: {accesses:,} accesses in {elapsed:.2f}s -> {accesses / elapsed:,.0f} accesses/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,104 @@
+import csv
+import sys
 import time
-import heapq
+from collections.abc import MutableMapping
+
+from metrics import ConsoleEvents
+from policies import make_policy
+
+
+# 子が少ないノードは dict ではなくタプルで持ち、線形探索する（dict は空でも 64B 以上）
+_SMALL_CHILDREN = 8
 
 
 class Node:
+    # 数百万ノードを想定して __dict__ を持たない固定レイアウトにする
+    __slots__ = (
+        "doc_id", "parent", "_children", "size", "cost", "frequency", "priority",
+        "location", "last_access", "gpu_children", "host_children", "heap_version", "pins",
+        "prefetched", "stored",
+    )
+
     def __init__(self, doc_id, parent=None, size=100, cost=10):
-        self.doc_id = doc_id
+        # 同じドキュメントIDは木の中で何度も現れるので文字列を共有する
+        self.doc_id = sys.intern(doc_id) if type(doc_id) is str else doc_id
         self.parent = parent
-        self.children = {}  # {doc_id: Node}
+        self._children = None  # None / (Node, ...) / {doc_id: Node}（復元直後の未展開の子は _child_table 参照）
         self.size = size    # Token size
-        self.cost = cost    # Recomputation cost (ms, simplified)
+        self.cost = cost    # Recomputation cost given the prefix (ms)
         self.frequency = 0
         self.priority = 0.0
         self.location = "DISK"  # DISK, HOST, GPU
-        
+
         # PGDSF metrics
         self.last_access = 0
-    
+
+        # Eviction index bookkeeping
+        self.gpu_children = 0   # GPU上にある子ノード数（0ならGPUの葉）
+        self.host_children = 0  # HOST上にある子ノード数（0ならHOSTの葉）
+        self.heap_version = 0   # ヒープ上の古いエントリを遅延無効化するための世代番号
+        self.pins = 0           # このノードを使用中のリクエスト数（>0 の間は追い出さない）
+        self.prefetched = False  # 先読みでGPUに載せ、まだアクセスされていない
+        self.stored = False      # KVをいずれかの階層に書いたことがある（追い出されても DISK に残る）
+
+    @property
+    def children(self):
+        """Writable view {doc_id: Node} over the compact children storage (add_child() is faster)."""
+        return _Children(self)
+
+    def add_child(self, child):
+        """Registers child under its doc_id (the doc_id must not be a child yet)."""
+        children = self._children
+        if children is None:
+            self._children = (child,)
+        elif type(children) is tuple:
+            if len(children) < _SMALL_CHILDREN:
+                self._children = children + (child,)
+            else:
+                self._children = {c.doc_id: c for c in children}
+                self._children[child.doc_id] = child
+        elif type(children) is dict:
+            children[child.doc_id] = child
+        else:
+            self._child_table()
+            self.add_child(child)
+        return child
+
+    def get_child(self, doc_id):
+        children = self._children
+        if children is None:
+            return None
+        if type(children) is tuple:
+            for c in children:
+                if c.doc_id == doc_id:
+                    return c
+            return None
+        if type(children) is not dict:
+            # 復元時に作らなかった子。引かれた1つだけを作る
+            return children.get(self, doc_id)
+        return children.get(doc_id)
+
+    def iter_children(self):
+        """Iterates child nodes without building a mapping."""
+        children = self._children
+        if children is None:
+            return ()
+        if type(children) is tuple:
+            return children
+        if type(children) is not dict:
+            self._child_table()
+            return self.iter_children()
+        return children.values()
+
+    def _child_table(self):
+        """Returns _children (None / tuple / dict), first creating the children a snapshot load deferred."""
+        children = self._children
+        if children is None or type(children) is tuple or type(children) is dict:
+            return children
+        # 復元時に作らなかった部分木。最初に子へ触れたときにスナップショットの列から作る
+        children = self._children = children.load(self)
+        return children
+
     def get_path(self):
         path = []
         curr = self
@@ -25,124 +108,613 @@ class Node:
         return path[::-1]
 
 
+class _Children(MutableMapping):
+    """
+    dict 互換の node.children。書き込みも Node の子の表（タプル / dict）に反映する
+    （従来どおり node.children[doc_id] = child で木を伸ばせる）。
+    """
+
+    __slots__ = ("_node",)
+
+    def __init__(self, node):
+        self._node = node
+
+    def __getitem__(self, doc_id):
+        child = self._node.get_child(doc_id)
+        if child is None:
+            raise KeyError(doc_id)
+        return child
+
+    def __setitem__(self, doc_id, child):
+        node = self._node
+        children = node._child_table()
+        if type(children) is dict:
+            children[doc_id] = child
+        elif doc_id == child.doc_id and node.get_child(doc_id) is None:
+            node.add_child(child)
+        else:
+            # 既存の子の置き換えや、doc_id と違うキーはタプルでは表せないので dict に切り替える
+            mapping = {c.doc_id: c for c in children or ()}
+            mapping[doc_id] = child
+            node._children = mapping
+
+    def __delitem__(self, doc_id):
+        node = self._node
+        children = node._child_table()
+        if type(children) is dict:
+            del children[doc_id]
+            if not children:
+                node._children = None
+            return
+        rest = tuple(c for c in children or () if c.doc_id != doc_id)
+        if len(rest) == len(children or ()):
+            raise KeyError(doc_id)
+        node._children = rest or None
+
+    def __iter__(self):
+        children = self._node._child_table()
+        if type(children) is dict:
+            return iter(children)
+        return (c.doc_id for c in children or ())
+
+    def __len__(self):
+        children = self._node._child_table()
+        return len(children) if children is not None else 0
+
+    def values(self):
+        return self._node.iter_children()
+
+
+class CacheTier:
+    """
+    One level of the memory hierarchy (GPU or HOST).
+    Each tier has its own eviction policy instance (and therefore its own PGDSF clock L).
+    """
+
+    def __init__(self, name, capacity, policy="pgdsf"):
+        self.name = name
+        self.capacity = capacity
+        self.usage = 0
+        self.nodes = 0  # Resident nodes (ROOT excluded)
+        self.policy = make_policy(policy)
+        self.policy.attach(self)
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def L(self):
+        return self.policy.L
+
+    def free(self):
+        return self.capacity - self.usage
+
+    def is_leaf(self, node):
+        """True if no child of node is resident in this tier."""
+        if self.name == "GPU":
+            return not node.gpu_children
+        return not node.host_children
+
+    def is_evictable(self, node):
+        """A leaf of this tier that no in-flight request has pinned."""
+        return not node.pins and self.is_leaf(node)
+
+
+class TransferModel:
+    """
+    KV-cache transfer cost between tiers.
+    デフォルトは Llama-2-7B 相当 (32層 x 4096次元 x K/V x fp16 = 512KiB/token)、
+    PCIe 4.0 x16 の実効帯域、NVMe SSD の帯域を想定。
+    """
+
+    def __init__(self, kv_bytes_per_token=2 * 32 * 4096 * 2, pcie_bandwidth=25e9, disk_bandwidth=3e9):
+        self.kv_bytes_per_token = kv_bytes_per_token
+        self.pcie_bandwidth = pcie_bandwidth  # bytes/sec
+        self.disk_bandwidth = disk_bandwidth  # bytes/sec
+
+    def bytes_for(self, tokens):
+        return tokens * self.kv_bytes_per_token
+
+    def seconds(self, src, dst, nbytes):
+        """GPU<->HOST は PCIe、DISK を経由する移動はディスク帯域 + PCIe。"""
+        t = 0.0
+        if "GPU" in (src, dst):
+            t += nbytes / self.pcie_bandwidth
+        if "DISK" in (src, dst):
+            t += nbytes / self.disk_bandwidth
+        return t
+
+
+class PrefillCostModel:
+    """
+    Recomputation (prefill) cost of a document's KV given the tokens before it:
+
+        cost_ms = per_token_ms * tokens + per_token_pair_ms * tokens * (prefix_tokens + tokens / 2)
+
+    第1項は線形層（トークン数に比例）、第2項は Attention（新しい各トークンが
+    プレフィックスと先行トークンを参照する分）。デフォルトは A100 上の 7B モデル程度の目安で、
+    実測値があれば fit() で係数を合わせる。
+    """
+
+    def __init__(self, per_token_ms=0.1, per_token_pair_ms=7e-6):
+        self.per_token_ms = per_token_ms
+        self.per_token_pair_ms = per_token_pair_ms
+
+    def prefill_ms(self, tokens, prefix_tokens):
+        return tokens * (self.per_token_ms + self.per_token_pair_ms * (prefix_tokens + tokens / 2))
+
+    @classmethod
+    def fit(cls, samples):
+        """
+        Least-squares calibration from measured prefill latencies.
+        samples: iterable of (tokens, prefix_tokens, latency_ms)
+        """
+        # 2変数・切片なしの正規方程式を解く
+        s11 = s12 = s22 = t1 = t2 = 0.0
+        for tokens, prefix_tokens, latency_ms in samples:
+            x1 = tokens
+            x2 = tokens * (prefix_tokens + tokens / 2)
+            s11 += x1 * x1
+            s12 += x1 * x2
+            s22 += x2 * x2
+            t1 += x1 * latency_ms
+            t2 += x2 * latency_ms
+
+        det = s11 * s22 - s12 * s12
+        if det == 0:
+            raise ValueError("Need latency samples with at least two different (tokens, prefix_tokens) shapes")
+        return cls(
+            per_token_ms=(t1 * s22 - t2 * s12) / det,
+            per_token_pair_ms=(t2 * s11 - t1 * s12) / det,
+        )
+
+    @classmethod
+    def from_csv(cls, path):
+        """Calibrates from a CSV with columns tokens, prefix_tokens, latency_ms."""
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls.fit(
+                (float(row["tokens"]), float(row["prefix_tokens"]), float(row["latency_ms"]))
+                for row in csv.DictReader(f)
+            )
+
+
+class Prefetcher:
+    """
+    Speculatively promotes likely next documents to GPU.
+
+    RAG の検索順序は偏りが大きい（D1 の次は D2 が来やすい）ので、Knowledge Tree の
+    子ノードの頻度から遷移確率 P(child | node) = child.frequency / node.frequency を求め、
+    threshold 以上の子を、リクエストあたり budget_bytes の転送量の範囲で先にGPUへ載せる。
+    アクセスが min_support 回未満のノードは統計が当てにならないので先読みしない。
+    """
+
+    def __init__(self, threshold=0.5, budget_bytes=256 * 2**20, max_candidates=2, min_support=4):
+        self.threshold = threshold
+        self.budget_bytes = budget_bytes
+        self.max_candidates = max_candidates
+        self.min_support = min_support
+
+        self.issued = 0
+        self.bytes = 0
+        self.hits = 0           # 先読みしたノードが実際にアクセスされた回数
+        self.wasted = 0         # アクセスされる前に追い出された回数
+        self.wasted_bytes = 0
+
+    def candidates(self, node):
+        """Children of node worth prefetching, most likely first."""
+        if node.frequency < self.min_support:
+            return []
+        likely = [
+            c for c in node.iter_children()
+            if c.location != "GPU" and c.frequency >= self.threshold * node.frequency
+        ]
+        likely.sort(key=lambda c: c.frequency, reverse=True)
+        return likely[:self.max_candidates]
+
+    def report(self):
+        return {
+            "issued": self.issued,
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "accuracy": self.hits / self.issued if self.issued else 0.0,
+            "wasted": self.wasted,
+            "wasted_bytes": self.wasted_bytes,
+        }
+
+
 class RAGCacheSimulator:
-    def __init__(self, gpu_capacity, host_capacity):
+    def __init__(self, gpu_capacity, host_capacity, verbose=True, transfer_model=None, policy="pgdsf",
+                 doc_tokens=None, cost_model=None, default_doc_tokens=100, prefetcher=None, events=None):
         self.root = Node("ROOT", size=10, cost=1)
         self.root.location = "GPU"
-        self.gpu_capacity = gpu_capacity
-        self.host_capacity = host_capacity
-        self.gpu_usage = 10  # Root size
-        self.host_usage = 0
-        self.clock = 0.0
-        
-        # Logical clock L for GDSF-like behavior
-        self.L = 0.0 
+        # policy: "lru", "lfu", "gdsf", "pgdsf", "arc" または EvictionPolicy のサブクラス
+        self.gpu = CacheTier("GPU", gpu_capacity, policy)
+        self.host = CacheTier("HOST", host_capacity, policy)
+        self.gpu.usage = 10  # Root size
+        self.clock = 0  # 整数の論理時刻（ノードごとの float オブジェクトを持たないため）
+        # イベントの通知先（None なら記録しない）。verbose=True はコンソール表示
+        self.events = events if events is not None else (ConsoleEvents() if verbose else None)
+
+        # DISK は容量無制限。hits = 過去に退避したKVの再ロード、misses = 初回の計算（または再計算の方が速い場合）
+        self.disk_hits = 0
+        self.disk_misses = 0
+
+        # GPUがピン留めされたノードで埋まっていて、キャッシュせずに使い捨てたアクセス数
+        self.gpu_bypass = 0
+
+        # Prefill（KV再計算）にかかった時間 / キャッシュにより省けた時間 (ms)
+        # GPU以外にあるKVは、読み込み（転送）と再計算の速い方を選ぶ。読み込んだ場合に省けた時間は
+        # node.cost - 読み込み時間で、その読み込み時間は reload_ms にも積む（転送全体は transfer_time）
+        self.prefill_ms = 0.0
+        self.prefill_saved_ms = 0.0
+        self.reload_ms = 0.0
+
+        self.transfer_model = transfer_model or TransferModel()
+        self.bytes_moved = {}     # {"GPU->HOST": bytes, ...}
+        self.transfer_time = {}   # {"GPU->HOST": sec, ...}
+
+        # ドキュメントごとのトークン数: {doc_id: tokens} または doc_id -> tokens の関数
+        self.doc_tokens = doc_tokens
+        self.default_doc_tokens = default_doc_tokens
+        self.cost_model = cost_model or PrefillCostModel()
+
+        # 先読み（None なら無効）
+        self.prefetcher = prefetcher
+
+    # 従来の属性名での参照を残す
+    @property
+    def gpu_capacity(self):
+        return self.gpu.capacity
+
+    @property
+    def host_capacity(self):
+        return self.host.capacity
+
+    @property
+    def gpu_usage(self):
+        return self.gpu.usage
+
+    @property
+    def host_usage(self):
+        return self.host.usage
+
+    @property
+    def L(self):
+        return self.gpu.L
 
     def access_sequence(self, doc_sequence):
         """
         Retrieves a sequence of documents (e.g., ["D1", "D2"]).
         Updates the tree and cache status.
         """
+        pinned = []
+        try:
+            self._access_path(doc_sequence, pinned)
+        finally:
+            self._unpin(pinned)
+
+    def access_batch(self, doc_sequences):
+        """
+        Admits a batch of concurrent requests (e.g., [["D1", "D2"], ["D1", "D3"]]).
+
+        Every node used by a request stays pinned in GPU until the whole batch has
+        completed, so a later request in the batch cannot evict a prefix that an
+        earlier, still in-flight request is using. Returns how much prefix sharing
+        the batch achieved.
+        """
+        pinned = []
+        seen = set()
+        accesses = 0
+        shared_accesses = 0
+        shared_tokens = 0
+        try:
+            for doc_sequence in doc_sequences:
+                for node in self._access_path(doc_sequence, pinned):
+                    accesses += 1
+                    if node in seen:
+                        # 同じバッチ内の別リクエストと共有したプレフィックス
+                        shared_accesses += 1
+                        shared_tokens += node.size
+                    else:
+                        seen.add(node)
+        finally:
+            self._unpin(pinned)
+
+        return {
+            "requests": len(doc_sequences),
+            "accesses": accesses,
+            "unique_nodes": len(seen),
+            "shared_accesses": shared_accesses,
+            "shared_tokens": shared_tokens,
+            "sharing_ratio": shared_accesses / accesses if accesses else 0.0,
+        }
+
+    def _access_path(self, doc_sequence, pinned):
+        """Walks/extends the tree for one request, pinning every node it makes resident in GPU."""
+        path = []
         current_node = self.root
-        
+        prefix_tokens = self.root.size
+        prefetch_budget = self.prefetcher.budget_bytes if self.prefetcher is not None else 0
+
         for doc_id in doc_sequence:
             self.clock += 1
-            
+
             # 1. Tree Traversal / Creation
-            if doc_id not in current_node.children:
-                # New node (simulate fetching logic)
-                new_node = Node(doc_id, parent=current_node)
-                current_node.children[doc_id] = new_node
-            
-            current_node = current_node.children[doc_id]
-            
-            # 2. Update Frequency & Priority (PGDSF-like Logic)
+            child = current_node.get_child(doc_id)
+            if child is None:
+                # New node: 再計算コストはプレフィックス長に依存する（同じ文書でも後ろほど高い）
+                tokens = self._tokens_for(doc_id)
+                cost = self.cost_model.prefill_ms(tokens, prefix_tokens)
+                child = current_node.add_child(Node(doc_id, parent=current_node, size=tokens, cost=cost))
+
+            current_node = child
+            path.append(child)
+            prefix_tokens += child.size
+            current_node.last_access = self.clock
+
+            # 2. Update Frequency (priority はポリシー側で計算)
             current_node.frequency += 1
-            
-            # Simple Cost/Size estimation for simulation
-            # （論文の式 (1) Priority = Clock + Frequency * (Cost/Size) の簡略版）
-            cost_factor = current_node.cost / current_node.size 
-            
-            # Update Priority
-            current_node.priority = self.L + current_node.frequency * cost_factor
-            
+
+            if current_node.prefetched:
+                current_node.prefetched = False
+                if current_node.location == "GPU":
+                    self.prefetcher.hits += 1
+
             # 3. Cache Management (Move to GPU if needed)
             if current_node.location != "GPU":
-                print(f"🔄 Miss! Loading {doc_id} to GPU...")
-                self._promote_to_gpu(current_node)
+                self.gpu.misses += 1
+                # 保存済みのKVがあっても、読み込みの方が遅ければ再計算する
+                # （GPUが満杯で使い捨てたノードはKVが書かれていないので、次のアクセスも再計算）
+                reload_ms = self._reload_ms(current_node) if current_node.stored else None
+                reload = reload_ms is not None and reload_ms < current_node.cost
+                if current_node.location == "HOST":
+                    self.host.hits += 1
+                else:
+                    self.host.misses += 1
+                    if reload:
+                        self.disk_hits += 1
+                    else:
+                        self.disk_misses += 1
+                if reload:
+                    self.prefill_saved_ms += current_node.cost - reload_ms
+                    self.reload_ms += reload_ms
+                else:
+                    self.prefill_ms += current_node.cost
+                if self.events is not None:
+                    self.events.on_event("miss", self, current_node)
+                if not self._promote_to_gpu(current_node, reload=reload):
+                    continue
+            else:
+                self.gpu.hits += 1
+                self.prefill_saved_ms += current_node.cost
+                if self.events is not None:
+                    self.events.on_event("hit", self, current_node)
+                self.gpu.policy.on_access(current_node)
+
+            # 後続のドキュメントをロードする間に、使用中のプレフィックスが追い出されないようにする
+            current_node.pins += 1
+            pinned.append(current_node)
+
+            if prefetch_budget > 0:
+                prefetch_budget = self._prefetch(current_node, prefetch_budget)
+
+        return path
+
+    def _prefetch(self, node, budget):
+        """Promotes likely children of node to GPU within the remaining transfer budget."""
+        for child in self.prefetcher.candidates(node):
+            # KVをどの階層にも書いていないノード（GPUが満杯で使い捨てたもの）は読み込めないので先読みしない
+            if not child.stored:
+                continue
+            nbytes = self.transfer_model.bytes_for(child.size)
+            if nbytes > budget:
+                continue
+            if not self._promote_to_gpu(child, prefetch=True):
+                break
+            child.prefetched = True
+            budget -= nbytes
+            self.prefetcher.issued += 1
+            self.prefetcher.bytes += nbytes
+            if self.events is not None:
+                self.events.on_event("prefetch", self, child)
+        return budget
+
+    def _unpin(self, pinned):
+        for node in pinned:
+            node.pins -= 1
+            if not node.pins and node.location == "GPU" and self.gpu.is_leaf(node):
+                # ピン留め中に追い出し候補から外れていたので登録し直す
+                self.gpu.policy.on_leaf(node)
+
+    def _tokens_for(self, doc_id):
+        doc_tokens = self.doc_tokens
+        if doc_tokens is None:
+            return self.default_doc_tokens
+        if callable(doc_tokens):
+            return doc_tokens(doc_id)
+        return doc_tokens.get(doc_id, self.default_doc_tokens)
+
+    def _reload_ms(self, node):
+        """Time to load the stored KV of node from its current tier into GPU (ms)."""
+        nbytes = self.transfer_model.bytes_for(node.size)
+        return self.transfer_model.seconds(node.location, "GPU", nbytes) * 1000
+
+    def _record_transfer(self, src, dst, node):
+        nbytes = self.transfer_model.bytes_for(node.size)
+        key = f"{src}->{dst}"
+        self.bytes_moved[key] = self.bytes_moved.get(key, 0) + nbytes
+        self.transfer_time[key] = self.transfer_time.get(key, 0.0) + self.transfer_model.seconds(src, dst, nbytes)
+
+    def _detach(self, node):
+        """Removes node from its current tier (GPU/HOST); its KV stays on DISK afterwards."""
+        parent = node.parent
+        if node.location == "GPU":
+            tier = self.gpu
+            if parent is not None:
+                parent.gpu_children -= 1
+        elif node.location == "HOST":
+            tier = self.host
+            if parent is not None:
+                parent.host_children -= 1
+        else:
+            return
+        tier.usage -= node.size
+        tier.nodes -= 1
+        node.location = "DISK"
+        tier.policy.on_remove(node)
+        # 親の最後の子が抜けたら、親が新たな葉として追い出し候補になる
+        if parent is not None and parent is not self.root and parent.location == tier.name and tier.is_leaf(parent):
+            tier.policy.on_leaf(parent)
+
+    def _attach(self, node, tier):
+        node.location = tier.name
+        node.stored = True
+        tier.usage += node.size
+        tier.nodes += 1
+        # 親は子を持つので葉ではなくなる（ヒープ上のエントリは pop 時に無効化）
+        if node.parent is not None:
+            if tier is self.gpu:
+                node.parent.gpu_children += 1
             else:
-                print(f"✅ Hit! {doc_id} is in GPU.")
-                # Update priority for hit case logic (simplified)
-                current_node.priority = self.L + current_node.frequency * cost_factor
+                node.parent.host_children += 1
+        tier.policy.on_insert(node)
 
-    def _promote_to_gpu(self, node):
-        """Moves a node to GPU, evicting others if necessary."""
+    def _promote_to_gpu(self, node, prefetch=False, reload=True):
+        """
+        Moves a node to GPU, evicting others if necessary. reload=False means the KV is
+        recomputed on GPU instead of being loaded from its tier (no transfer is recorded).
+        Returns False if GPU is full of pinned nodes and the node was used without being cached.
+        """
         required_size = node.size
-        
+        src = node.location
+        # ROOT 以外を全部追い出しても入らない: 階層から外す前に判定する（HOST の使用量・索引を壊さない）
+        if required_size > self.gpu.capacity - self.root.size:
+            if not prefetch:
+                raise Exception("OOM: Cannot fit even after eviction!")
+            return False
+        # 追い出しの連鎖（GPU -> HOST -> DISK）で自分自身が押し出されないよう先に外す
+        self._detach(node)
+
         # Evict until space is available
-        while (self.gpu_capacity - self.gpu_usage) < required_size:
+        while self.gpu.free() < required_size:
             evicted = self._evict_from_gpu()
             if not evicted:
-                raise Exception("OOM: Cannot fit even after eviction!")
-        
+                # 実行中のリクエストが使うノードで埋まっている: KVはその場限りで使い捨てる
+                if not prefetch:
+                    self.gpu_bypass += 1
+                if src == "HOST":
+                    if self.host.free() >= node.size:
+                        self._attach(node, self.host)
+                    else:
+                        self._record_transfer("HOST", "DISK", node)
+                if self.events is not None and not prefetch:
+                    self.events.on_event("bypass", self, node)
+                return False
+
         # Promote
-        if node.location == "HOST":
-            self.host_usage -= node.size
-        node.location = "GPU"
-        self.gpu_usage += node.size
-        print(f"   -> Promoted {node.doc_id} to GPU. Usage: {self.gpu_usage}/{self.gpu_capacity}")
+        if reload:
+            self._record_transfer(src, "GPU", node)
+        self._attach(node, self.gpu)
+
+        if self.events is not None:
+            self.events.on_event("promote", self, node)
+        return True
 
     def _evict_from_gpu(self):
-        """Finds the lowest priority leaf node in GPU to evict."""
-        # Traverse tree to find GPU nodes (simplified DFS)
-        stack = [self.root]
-        gpu_nodes = []
-        while stack:
-            n = stack.pop()
-            if n.location == "GPU" and n != self.root:  # Don't evict root
-                gpu_nodes.append(n)
-            for child in n.children.values():
-                stack.append(child)
-        
-        if not gpu_nodes:
+        """Asks the GPU policy for a victim leaf and demotes it to HOST."""
+        # In実システム: まず葉ノードから優先的に追い出す（PGDSFの設計方針に対応）
+        victim = self.gpu.policy.pop_victim()
+        if victim is None:
             return False
+        self._demote_from_gpu(victim)
+        return True
 
-        # In実システム: まず葉ノードから優先的に追い出す（PGDSFの設計方針に対応）
-        leaf_candidates = [n for n in gpu_nodes if all(c.location != "GPU" for c in n.children.values())]
-        
-        if not leaf_candidates:
-            # Fallback if no clean leaves (shouldn't happen in strict tree)
-            leaf_candidates = gpu_nodes
-
-        victim = min(leaf_candidates, key=lambda x: x.priority)
-        
-        # Eviction時に L を victim の priority に更新（GDSFのClock更新ルール）
-        self.L = max(self.L, victim.priority)
-        
-        # Demote to Host
-        victim.location = "HOST"
-        self.gpu_usage -= victim.size
-        self.host_usage += victim.size
-        print(f"   👋 Evicted {victim.doc_id} (P={victim.priority:.2f}) to HOST.")
+    def _demote_from_gpu(self, victim):
+        if victim.prefetched:
+            # 先読みしたがアクセスされないまま追い出された
+            victim.prefetched = False
+            self.prefetcher.wasted += 1
+            self.prefetcher.wasted_bytes += self.transfer_model.bytes_for(victim.size)
+        self.gpu.policy.on_evict(victim)
+        self._detach(victim)
+
+        # Demote to Host（HOSTに入りきらなければ HOST 側も追い出す）
+        if victim.size > self.host.capacity:
+            self._record_transfer("GPU", "DISK", victim)
+            if self.events is not None:
+                self.events.on_event("evict_disk", self, victim)
+            return
+
+        while self.host.free() < victim.size:
+            self._evict_from_host()
+
+        self._record_transfer("GPU", "HOST", victim)
+        if self.events is not None:
+            self.events.on_event("evict", self, victim)
+        # HOST側の優先度は HOST のポリシー（HOST の clock）で付け直される
+        self._attach(victim, self.host)
+
+    def _evict_from_host(self):
+        """Spills the lowest priority HOST leaf back to DISK."""
+        victim = self.host.policy.pop_victim()
+        if victim is None:
+            return False
+
+        self.host.policy.on_evict(victim)
+        self._detach(victim)
+        self._record_transfer("HOST", "DISK", victim)
+        if self.events is not None:
+            self.events.on_event("spill", self, victim)
         return True
 
+    def report(self):
+        """Per-tier hit/miss counters and modelled transfer cost."""
+        return {
+            "gpu": {"hits": self.gpu.hits, "misses": self.gpu.misses,
+                    "usage": self.gpu.usage, "capacity": self.gpu.capacity},
+            "host": {"hits": self.host.hits, "misses": self.host.misses,
+                     "usage": self.host.usage, "capacity": self.host.capacity},
+            "disk": {"hits": self.disk_hits, "misses": self.disk_misses},
+            "gpu_bypass": self.gpu_bypass,
+            "prefetch": self.prefetcher.report() if self.prefetcher is not None else None,
+            "prefill_ms": self.prefill_ms,
+            "prefill_saved_ms": self.prefill_saved_ms,
+            "reload_ms": self.reload_ms,
+            "bytes_moved": dict(self.bytes_moved),
+            "transfer_time_sec": dict(self.transfer_time),
+        }
+
 
 # --- 実行 ---
-# GPU容量 350 (小さい設定), Hostは十分大きいと仮定
-sim = RAGCacheSimulator(gpu_capacity=350, host_capacity=1000)
+if __name__ == "__main__":
+    # GPU容量 350 (小さい設定), Hostは 200（2ノード分）として HOST -> DISK の退避も起こす
+    sim = RAGCacheSimulator(gpu_capacity=350, host_capacity=200)
+
+
+    print("--- Step 1: Request [D1, D2] ---")
+    sim.access_sequence(["D1", "D2"])
+
+
+    print("\n--- Step 2: Request [D1, D3] (D1 should hit) ---")
+    sim.access_sequence(["D1", "D3"])
 
 
-print("--- Step 1: Request [D1, D2] ---")
-sim.access_sequence(["D1", "D2"]) 
+    print("\n--- Step 3: Request [D4, D5] (Forces eviction) ---")
+    sim.access_sequence(["D4", "D5"])
 
 
-print("\n--- Step 2: Request [D1, D3] (D1 should hit) ---")
-sim.access_sequence(["D1", "D3"])
+    print("\n--- Step 4: Request [D1, D2] again (D1 should stay/return) ---")
+    sim.access_sequence(["D1", "D2"])
 
 
-print("\n--- Step 3: Request [D4, D5] (Forces eviction) ---")
-sim.access_sequence(["D4", "D5"])
+    print("\n--- Step 5: Request [D6, D7] (HOST is full -> spill to DISK) ---")
+    sim.access_sequence(["D6", "D7"])
 
 
-print("\n--- Step 4: Request [D1, D2] again (D1 should stay/return) ---")
-sim.access_sequence(["D1", "D2"])
\ No newline at end of file
+    print("\n--- Stats ---")
+    for tier in ("gpu", "host", "disk"):
+        stats = sim.report()[tier]
+        print(f"{tier.upper():>4}: hits={stats['hits']} misses={stats['misses']}")
+    for key, sec in sim.transfer_time.items():
+        print(f"{key:>10}: {sim.bytes_moved[key] / 2**20:.1f} MiB, {sec * 1000:.2f} ms")
+    print(f"Prefill: computed {sim.prefill_ms:.1f} ms, saved {sim.prefill_saved_ms:.1f} ms by the cache")
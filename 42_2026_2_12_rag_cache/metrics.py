@@ -0,0 +1,138 @@
+"""
+Event sinks for RAGCacheSimulator.
+
+The simulator calls sink.on_event(kind, sim, node) on every cache event when a sink
+is set (sim.events is None -> no overhead beyond one attribute check).
+
+  kind: "hit", "miss", "promote", "evict" (GPU -> HOST), "evict_disk" (GPU -> DISK),
+        "spill" (HOST -> DISK), "bypass", "prefetch"
+"""
+import csv
+import math
+from array import array
+
+
+EVENT_KINDS = ("hit", "miss", "promote", "evict", "evict_disk", "spill", "bypass", "prefetch")
+_KIND_CODE = {kind: i for i, kind in enumerate(EVENT_KINDS)}
+
+
+class ConsoleEvents:
+    """Human-readable log of every event (the simulator's verbose mode)."""
+
+    def on_event(self, kind, sim, node):
+        if kind == "miss":
+            print(f"🔄 Miss! Loading {node.doc_id} to GPU...")
+        elif kind == "hit":
+            print(f"✅ Hit! {node.doc_id} is in GPU.")
+        elif kind == "promote":
+            print(f"   -> Promoted {node.doc_id} to GPU. Usage: {sim.gpu.usage}/{sim.gpu.capacity}")
+        elif kind == "evict":
+            print(f"   👋 Evicted {node.doc_id} (P={node.priority:.2f}) to HOST.")
+        elif kind == "evict_disk":
+            print(f"   👋 Evicted {node.doc_id} (P={node.priority:.2f}) to DISK.")
+        elif kind == "spill":
+            print(f"   💾 Spilled {node.doc_id} (P={node.priority:.2f}) to DISK.")
+        elif kind == "bypass":
+            print(f"   ⛔ GPU is full of pinned nodes; {node.doc_id} is not cached.")
+        elif kind == "prefetch":
+            print(f"   🔮 Prefetched {node.doc_id} to GPU.")
+
+
+class MetricsRecorder:
+    """
+    Low-overhead metrics for long replays.
+
+    - counters: 種類ごとのイベント数
+    - eviction_histogram: 追い出し時の priority の log2 ヒストグラム {指数: 件数}（tierごと）
+    - occupancy: sample_every アクセスごとの GPU / HOST 使用量
+    - events: record_events=True のときだけ、全イベントを列指向（array）で保持
+    """
+
+    def __init__(self, sample_every=1000, record_events=False):
+        self.sample_every = sample_every
+        self.record_events = record_events
+
+        self.counters = dict.fromkeys(EVENT_KINDS, 0)
+        self.eviction_histogram = {"GPU": {}, "HOST": {}}
+
+        self._accesses = 0
+        self.occupancy = {
+            "clock": array("q"),
+            "gpu_usage": array("q"),
+            "host_usage": array("q"),
+        }
+
+        self.events = {
+            "clock": array("q"),
+            "kind": array("b"),
+            "doc_id": [],
+            "priority": array("d"),
+            "gpu_usage": array("q"),
+            "host_usage": array("q"),
+        }
+
+    def on_event(self, kind, sim, node):
+        self.counters[kind] += 1
+
+        if kind == "hit" or kind == "miss":
+            self._accesses += 1
+            if self._accesses % self.sample_every == 0:
+                occupancy = self.occupancy
+                occupancy["clock"].append(sim.clock)
+                occupancy["gpu_usage"].append(sim.gpu.usage)
+                occupancy["host_usage"].append(sim.host.usage)
+        elif kind == "evict" or kind == "evict_disk" or kind == "spill":
+            histogram = self.eviction_histogram["HOST" if kind == "spill" else "GPU"]
+            bucket = math.frexp(node.priority)[1] if node.priority > 0 else None
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+        if self.record_events:
+            events = self.events
+            events["clock"].append(sim.clock)
+            events["kind"].append(_KIND_CODE[kind])
+            events["doc_id"].append(node.doc_id)
+            events["priority"].append(node.priority)
+            events["gpu_usage"].append(sim.gpu.usage)
+            events["host_usage"].append(sim.host.usage)
+
+    def event_columns(self):
+        columns = dict(self.events)
+        columns["kind"] = [EVENT_KINDS[code] for code in self.events["kind"]]
+        return columns
+
+    def histogram_rows(self):
+        """(tier, lower bound of the priority bucket, count) sorted by bucket."""
+        rows = []
+        for tier, histogram in self.eviction_histogram.items():
+            for bucket in sorted(histogram, key=lambda b: -math.inf if b is None else b):
+                lower = 0.0 if bucket is None else 2.0 ** (bucket - 1)
+                rows.append((tier, lower, histogram[bucket]))
+        return rows
+
+    def dump(self, path):
+        """Writes the event log (record_events=True) as .parquet (pyarrow) or .csv."""
+        write_columns(path, self.event_columns())
+
+    def dump_occupancy(self, path):
+        """Writes the per-tier occupancy time series as .parquet (pyarrow) or .csv."""
+        write_columns(path, self.occupancy)
+
+
+def write_columns(path, columns):
+    """Writes {name: sequence} columns; Parquet needs pyarrow, anything else is CSV."""
+    path = str(path)
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing Parquet requires pyarrow: pip install pyarrow") from e
+
+        pq.write_table(pa.table({name: list(values) for name, values in columns.items()}), path)
+        return
+
+    names = list(columns)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(columns[name] for name in names)))
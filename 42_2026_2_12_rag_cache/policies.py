@@ -0,0 +1,301 @@
+"""
+Eviction policies for RAGCacheSimulator.
+
+Each CacheTier (GPU / HOST) owns its own policy instance. The simulator tells the
+policy when a node enters the tier, is accessed there, becomes a leaf or leaves,
+and asks it for the next victim. Victims must be leaves of the tier (no child
+resident in the same tier), so that a cached prefix is never dropped before the
+documents that depend on it, and must not be pinned by an in-flight request.
+"""
+import heapq
+from collections import OrderedDict
+from operator import attrgetter
+
+
+class EvictionPolicy:
+    name = "base"
+
+    def __init__(self):
+        self.tier = None
+        # Logical clock L (GDSF 系のみ進める。他のポリシーでは 0 のまま)
+        self.L = 0.0
+
+    def attach(self, tier):
+        self.tier = tier
+
+    def on_insert(self, node):
+        """node has just become resident in the tier."""
+        raise NotImplementedError
+
+    def on_access(self, node):
+        """node was hit in the tier."""
+        raise NotImplementedError
+
+    def on_leaf(self, node):
+        """node became evictable again (its last resident child left the tier, or it was unpinned)."""
+
+    def on_remove(self, node):
+        """node left the tier (evicted or promoted to another tier)."""
+
+    def pop_victim(self):
+        """Returns the next node to evict (already unindexed), or None."""
+        raise NotImplementedError
+
+    def on_evict(self, victim):
+        """Called once a victim returned by pop_victim is actually evicted."""
+
+    def state(self):
+        """Policy-wide state to keep in a snapshot (see snapshot.py)."""
+        return {"L": self.L}
+
+    def lists(self):
+        """Ordered node lists to keep in a snapshot besides the resident set ({name: [Node, ...]})."""
+        return {}
+
+    def restore(self, state, nodes, lists=None):
+        """
+        Rebuilds the index from a snapshot. nodes are the tier's resident nodes
+        in tree (BFS) order, with priority already restored; lists is what
+        lists() returned at save time (None for snapshots without it).
+        """
+        self.L = state.get("L", 0.0)
+        for node in sorted(nodes, key=attrgetter("last_access")):
+            self.on_insert(node)
+
+
+class PriorityPolicy(EvictionPolicy):
+    """
+    Evicts the leaf with the lowest priority(node).
+    Evictable leaves live in a heap with lazy invalidation: an entry is stale when
+    the node was re-pushed (heap_version changed), left the tier or stopped being a leaf.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # (priority, last_access, seq, version, node)
+        # 同じ priority なら最後のアクセスが古いノードから追い出す
+        self.heap = []
+        self._seq = 0
+
+    def priority(self, node):
+        raise NotImplementedError
+
+    def on_insert(self, node):
+        node.priority = self.priority(node)
+        self._push_if_leaf(node)
+
+    def on_access(self, node):
+        # 優先度が変わったので葉ならヒープに積み直す
+        node.priority = self.priority(node)
+        self._push_if_leaf(node)
+
+    def on_leaf(self, node):
+        self._push_if_leaf(node)
+
+    def restore(self, state, nodes, lists=None):
+        # 保存済みの priority をそのまま使い、heappush ではなく heapify で一括構築する。
+        # (priority, last_access) が同じノードは木の順に seq を振るので、アクセス順に並べ直す必要はない
+        self.L = state.get("L", 0.0)
+        heap = []
+        seq = self._seq
+        # 復元直後はピン留めがないので、葉かどうかだけを見る
+        resident_children = attrgetter("gpu_children" if self.tier.name == "GPU" else "host_children")
+        for node in nodes:
+            if not resident_children(node):
+                node.heap_version += 1
+                seq += 1
+                heap.append((node.priority, node.last_access, seq, node.heap_version, node))
+        heapq.heapify(heap)
+        self.heap = heap
+        self._seq = seq
+
+    def pop_victim(self):
+        heap = self.heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if self._is_live(entry):
+                return entry[4]
+        return None
+
+    def _push_if_leaf(self, node):
+        if not self.tier.is_evictable(node):
+            return
+        node.heap_version += 1
+        self._seq += 1
+        heapq.heappush(self.heap, (node.priority, node.last_access, self._seq, node.heap_version, node))
+        # 無効エントリが溜まりすぎたら生きているものだけで作り直す
+        if len(self.heap) > 2 * self.tier.nodes + 1024:
+            self.heap = [entry for entry in self.heap if self._is_live(entry)]
+            heapq.heapify(self.heap)
+
+    def _is_live(self, entry):
+        node = entry[4]
+        return entry[3] == node.heap_version and node.location == self.tier.name and self.tier.is_evictable(node)
+
+
+class LRUPolicy(PriorityPolicy):
+    name = "lru"
+
+    def priority(self, node):
+        return node.last_access
+
+
+class LFUPolicy(PriorityPolicy):
+    name = "lfu"
+
+    def priority(self, node):
+        return node.frequency
+
+
+class GDSFPolicy(PriorityPolicy):
+    """Greedy-Dual-Size-Frequency with a uniform cost: L + Frequency / Size."""
+
+    name = "gdsf"
+
+    def priority(self, node):
+        return self.L + node.frequency / node.size
+
+    def on_evict(self, victim):
+        # Eviction時に L を victim の priority に更新（GDSFのClock更新ルール）
+        self.L = max(self.L, victim.priority)
+
+
+class PGDSFPolicy(GDSFPolicy):
+    """
+    Prefix-aware GDSF (RAGCache): L + Frequency * Cost / Size,
+    where Cost is the recomputation cost of the node given its prefix.
+    """
+
+    name = "pgdsf"
+
+    def priority(self, node):
+        # （論文の式 (1) Priority = Clock + Frequency * (Cost/Size) の簡略版）
+        return self.L + node.frequency * (node.cost / node.size)
+
+
+class ARCPolicy(EvictionPolicy):
+    """
+    Adaptive Replacement Cache, sized in tokens instead of entries.
+
+    T1/T2 hold resident nodes seen once / more than once, B1/B2 are ghost lists of
+    recently evicted nodes. A ghost hit moves the target size p of T1 towards the
+    list that would have kept the node.
+    """
+
+    name = "arc"
+
+    def __init__(self):
+        super().__init__()
+        self.p = 0.0
+        self.t1, self.t2 = OrderedDict(), OrderedDict()
+        self.b1, self.b2 = OrderedDict(), OrderedDict()
+        # 各リストのトークン数
+        self.size = {"t1": 0, "t2": 0, "b1": 0, "b2": 0}
+
+    def on_insert(self, node):
+        c = self.tier.capacity
+        if node in self.b1:
+            delta = max(self.size["b2"] / max(self.size["b1"], 1), 1) * node.size
+            self.p = min(c, self.p + delta)
+            self._pop(self.b1, "b1", node)
+            self._put(self.t2, "t2", node)
+        elif node in self.b2:
+            delta = max(self.size["b1"] / max(self.size["b2"], 1), 1) * node.size
+            self.p = max(0.0, self.p - delta)
+            self._pop(self.b2, "b2", node)
+            self._put(self.t2, "t2", node)
+        else:
+            self._put(self.t1, "t1", node)
+        node.priority = 0.0
+
+        # Ghost lists: |T1| + |B1| <= c, |T1| + |T2| + |B1| + |B2| <= 2c
+        while self.b1 and self.size["t1"] + self.size["b1"] > c:
+            self._pop(self.b1, "b1")
+        while self.b2 and sum(self.size.values()) > 2 * c:
+            self._pop(self.b2, "b2")
+
+    def state(self):
+        return {"L": self.L, "p": self.p}
+
+    def lists(self):
+        return {"t1": list(self.t1), "t2": list(self.t2), "b1": list(self.b1), "b2": list(self.b2)}
+
+    def restore(self, state, nodes, lists=None):
+        self.L = state.get("L", 0.0)
+        self.p = state.get("p", 0.0)
+        if lists is not None:
+            # T1/T2 の LRU 順とゴーストリストをそのまま戻す
+            for key in ("t1", "t2", "b1", "b2"):
+                lst = getattr(self, key)
+                for node in lists.get(key, ()):
+                    self._put(lst, key, node)
+            return
+        # リストのないスナップショット（別ポリシーで保存したもの）: 2回以上アクセスされたノードを T2、それ以外を T1 に
+        # 古いアクセスから置く
+        for node in sorted(nodes, key=attrgetter("last_access")):
+            if node.frequency > 1:
+                self._put(self.t2, "t2", node)
+            else:
+                self._put(self.t1, "t1", node)
+
+    def on_access(self, node):
+        if node in self.t1:
+            self._pop(self.t1, "t1", node)
+        elif node in self.t2:
+            self._pop(self.t2, "t2", node)
+        self._put(self.t2, "t2", node)
+
+    def on_remove(self, node):
+        if node in self.t1:
+            self._pop(self.t1, "t1", node)
+        elif node in self.t2:
+            self._pop(self.t2, "t2", node)
+
+    def pop_victim(self):
+        if self.t1 and (self.size["t1"] > self.p or not self.t2):
+            order = ((self.t1, "t1", self.b1, "b1"), (self.t2, "t2", self.b2, "b2"))
+        else:
+            order = ((self.t2, "t2", self.b2, "b2"), (self.t1, "t1", self.b1, "b1"))
+
+        for lst, key, ghost, ghost_key in order:
+            victim = self._pop_lru_leaf(lst)
+            if victim is not None:
+                self.size[key] -= victim.size
+                self._put(ghost, ghost_key, victim)
+                return victim
+        return None
+
+    def _pop_lru_leaf(self, lst):
+        # 子が同じ階層に残っている（プレフィックスとして使われている）ノードや
+        # ピン留め中のノードは、参照中とみなして MRU 側へ回す（償却 O(1)）
+        for _ in range(len(lst)):
+            node = next(iter(lst))
+            if self.tier.is_evictable(node):
+                del lst[node]
+                return node
+            lst.move_to_end(node)
+        return None
+
+    def _put(self, lst, key, node):
+        lst[node] = None
+        self.size[key] += node.size
+
+    def _pop(self, lst, key, node=None):
+        if node is None:
+            node, _ = lst.popitem(last=False)
+        else:
+            del lst[node]
+        self.size[key] -= node.size
+
+
+POLICIES = {cls.name: cls for cls in (LRUPolicy, LFUPolicy, GDSFPolicy, PGDSFPolicy, ARCPolicy)}
+
+
+def make_policy(policy):
+    """Accepts a policy name ("lru", "pgdsf", ...) or an EvictionPolicy subclass."""
+    if isinstance(policy, str):
+        try:
+            return POLICIES[policy.lower()]()
+        except KeyError:
+            raise ValueError(f"Unknown eviction policy: {policy} (choose from {', '.join(POLICIES)})")
+    return policy()
@@ -0,0 +1,288 @@
+"""
+Trace-driven replay and capacity sweep for RAGCacheSimulator.
+
+  # 実ログ (JSONL / Parquet) を GPU x HOST 容量の全組み合わせで並列に再生
+  python replay.py queries.jsonl --gpu-capacity 20000 50000 100000 --host-capacity 0 200000 --workers 8
+
+  # トレースがなければ Zipf 分布の合成トレースで試す
+  python replay.py --synthetic 100000 --gpu-capacity 5000 20000
+
+  # 同じトレースで追い出しポリシーを比較
+  python replay.py queries.jsonl --gpu-capacity 20000 --policy lru lfu gdsf pgdsf arc
+
+  # 同時に処理されるリクエスト 32 件ずつ（バッチ内ではノードをピン留め）で再生
+  python replay.py queries.jsonl --gpu-capacity 20000 --batch-size 32
+
+  # 先読み（遷移確率のしきい値ごと）の hit率改善と無駄な転送量を比較
+  python replay.py queries.jsonl --gpu-capacity 20000 --prefetch 0.3 0.5 --prefetch-budget-mb 256
+
+  # 設定ごとのメトリクス（階層使用量の推移、追い出し priority のヒストグラム、全イベント）を保存
+  python replay.py queries.jsonl --gpu-capacity 20000 --metrics-dir metrics/ --record-events --metrics-format parquet
+
+  # 文書ごとのトークン数と、実測レイテンシで校正した Prefill コストを使う
+  python replay.py queries.jsonl --gpu-capacity 200000 --doc-tokens doc_tokens.json --calibration prefill_latency.csv
+
+各設定ごとに hit率、階層間の転送バイト数、推定 Prefill 削減時間を出力する。
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import PrefillCostModel, Prefetcher, RAGCacheSimulator, TransferModel
+from metrics import MetricsRecorder, write_columns
+from policies import POLICIES
+from traces import read_trace, synthetic_trace
+
+
+# Critical path に乗る転送（GPUへのロード）。GPU -> HOST の退避は計算と重ねられる前提
+_LOAD_TRANSFERS = ("HOST->GPU", "DISK->GPU")
+
+
+def run_config(trace_args, gpu_capacity, host_capacity, policy, prefetch, model_args):
+    """Replays the whole trace against one (gpu_capacity, host_capacity, policy, prefetch) configuration."""
+    doc_tokens = None
+    if model_args["doc_tokens"]:
+        with open(model_args["doc_tokens"], encoding="utf-8") as f:
+            doc_tokens = json.load(f)
+    cost_model = None
+    if model_args["calibration"]:
+        cost_model = PrefillCostModel.from_csv(model_args["calibration"])
+    metrics = None
+    if model_args["metrics_dir"]:
+        metrics = MetricsRecorder(record_events=model_args["record_events"])
+
+    sim = RAGCacheSimulator(
+        gpu_capacity=gpu_capacity,
+        host_capacity=host_capacity,
+        verbose=False,
+        transfer_model=TransferModel(kv_bytes_per_token=model_args["kv_bytes_per_token"]),
+        policy=policy,
+        doc_tokens=doc_tokens,
+        cost_model=cost_model,
+        prefetcher=(
+            Prefetcher(threshold=prefetch, budget_bytes=model_args["prefetch_budget_mb"] * 2**20)
+            if prefetch is not None else None
+        ),
+        events=metrics,
+    )
+
+    requests = 0
+    shared_accesses = 0
+    batch_size = model_args["batch_size"]
+    start = time.perf_counter()
+    if batch_size > 1:
+        trace = iter(open_trace(**trace_args))
+        while True:
+            batch = list(itertools.islice(trace, batch_size))
+            if not batch:
+                break
+            shared_accesses += sim.access_batch(batch)["shared_accesses"]
+            requests += len(batch)
+    else:
+        for seq in open_trace(**trace_args):
+            sim.access_sequence(seq)
+            requests += 1
+    elapsed = time.perf_counter() - start
+
+    if metrics is not None:
+        dump_metrics(metrics, model_args, gpu_capacity, host_capacity, policy, prefetch)
+
+    report = sim.report()
+    accesses = sim.gpu.hits + sim.gpu.misses
+    # DISK は容量無制限なので含めない（含めると GPU / HOST の容量を変えても動かない）
+    cached = sim.gpu.hits + sim.host.hits
+    load_ms = sum(sim.transfer_time.get(key, 0.0) for key in _LOAD_TRANSFERS) * 1000
+
+    return {
+        "gpu_capacity": gpu_capacity,
+        "host_capacity": host_capacity,
+        "policy": policy,
+        "prefetch": prefetch,
+        "requests": requests,
+        "accesses": accesses,
+        "gpu_hit_rate": sim.gpu.hits / accesses if accesses else 0.0,
+        "host_hit_rate": sim.host.hits / sim.gpu.misses if sim.gpu.misses else 0.0,
+        "cache_hit_rate": cached / accesses if accesses else 0.0,
+        "batch_sharing_ratio": shared_accesses / accesses if accesses else 0.0,
+        "gpu_bypass": report["gpu_bypass"],
+        "bytes_moved": sum(report["bytes_moved"].values()),
+        **{f"bytes_{key.replace('->', '_to_').lower()}": v for key, v in report["bytes_moved"].items()},
+        "prefill_ms": report["prefill_ms"],
+        "prefill_saved_ms": report["prefill_saved_ms"],
+        "prefill_saved_ratio": (
+            report["prefill_saved_ms"] / (report["prefill_saved_ms"] + report["prefill_ms"])
+            if accesses else 0.0
+        ),
+        "load_ms": load_ms,
+        # アクセス時の読み込みは prefill_saved_ms から差し引き済み。残り（先読みの転送）を引く
+        "net_prefill_saved_ms": report["prefill_saved_ms"] - (load_ms - report["reload_ms"]),
+        **({
+            "prefetch_bytes": report["prefetch"]["bytes"],
+            "prefetch_hits": report["prefetch"]["hits"],
+            "prefetch_accuracy": report["prefetch"]["accuracy"],
+            "prefetch_wasted_bytes": report["prefetch"]["wasted_bytes"],
+        } if report["prefetch"] is not None else {}),
+        "replay_sec": elapsed,
+    }
+
+
+def dump_metrics(metrics, model_args, gpu_capacity, host_capacity, policy, prefetch):
+    name = f"gpu{gpu_capacity}_host{host_capacity}_{policy}"
+    if prefetch is not None:
+        name += f"_pf{prefetch}"
+    prefix = os.path.join(model_args["metrics_dir"], name)
+    ext = model_args["metrics_format"]
+
+    metrics.dump_occupancy(f"{prefix}_occupancy.{ext}")
+    rows = metrics.histogram_rows()
+    write_columns(f"{prefix}_evictions.{ext}", {
+        "tier": [tier for tier, _, _ in rows],
+        "priority_from": [lower for _, lower, _ in rows],
+        "count": [count for _, _, count in rows],
+    })
+    if model_args["record_events"]:
+        metrics.dump(f"{prefix}_events.{ext}")
+
+
+def open_trace(path=None, column="docs", synthetic=0, num_docs=100_000, seed=0):
+    """Each worker process streams the trace on its own (nothing big is pickled across processes)."""
+    if path is not None:
+        return read_trace(path, column=column)
+    return synthetic_trace(synthetic, num_docs=num_docs, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a retrieval trace against many cache sizes")
+    parser.add_argument("trace", nargs="?", help="JSONL or .parquet trace (one doc-id sequence per request)")
+    parser.add_argument("--column", default="docs", help="JSONのキー / Parquetの列名")
+    parser.add_argument("--synthetic", type=int, default=0, help="合成トレースのリクエスト数（trace未指定時）")
+    parser.add_argument("--num-docs", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gpu-capacity", type=int, nargs="+", required=True, help="tokens")
+    parser.add_argument("--host-capacity", type=int, nargs="+", default=[0], help="tokens")
+    parser.add_argument("--policy", nargs="+", default=["pgdsf"], choices=list(POLICIES))
+    parser.add_argument("--kv-bytes-per-token", type=int, default=2 * 32 * 4096 * 2)
+    parser.add_argument("--batch-size", type=int, default=1, help="同時に処理するリクエスト数")
+    parser.add_argument("--prefetch", type=float, nargs="+", metavar="THRESHOLD",
+                        help="先読みする遷移確率のしきい値（先読みなしの結果と比較する）")
+    parser.add_argument("--prefetch-budget-mb", type=float, default=256, help="リクエストあたりの先読み転送量")
+    parser.add_argument("--doc-tokens", help='文書ごとのトークン数 JSON ({"D1": 812, ...})')
+    parser.add_argument("--calibration", help="Prefill 実測値 CSV (tokens, prefix_tokens, latency_ms)")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（デフォルトはCPU数）")
+    parser.add_argument("--output", help="結果の保存先 (.csv / .jsonl)")
+    parser.add_argument("--metrics-dir", help="設定ごとの使用量推移 / 追い出しヒストグラムの保存先")
+    parser.add_argument("--metrics-format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--record-events", action="store_true", help="全イベントを列指向ファイルに保存する")
+    args = parser.parse_args()
+
+    if args.trace is None and not args.synthetic:
+        parser.error("trace か --synthetic のどちらかを指定してください")
+
+    trace_args = {
+        "path": args.trace,
+        "column": args.column,
+        "synthetic": args.synthetic,
+        "num_docs": args.num_docs,
+        "seed": args.seed,
+    }
+    model_args = {
+        "kv_bytes_per_token": args.kv_bytes_per_token,
+        "doc_tokens": args.doc_tokens,
+        "calibration": args.calibration,
+        "batch_size": args.batch_size,
+        "prefetch_budget_mb": args.prefetch_budget_mb,
+        "metrics_dir": args.metrics_dir,
+        "metrics_format": args.metrics_format,
+        "record_events": args.record_events,
+    }
+    if args.metrics_dir:
+        os.makedirs(args.metrics_dir, exist_ok=True)
+    prefetch = [None] + args.prefetch if args.prefetch else [None]
+    configs = list(itertools.product(args.gpu_capacity, args.host_capacity, args.policy, prefetch))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(run_config, trace_args, gpu, host, policy, pf, model_args)
+            for gpu, host, policy, pf in configs
+        ]
+        results = [f.result() for f in futures]
+
+    print(f"{'GPU':>10} {'HOST':>10} {'policy':>6} {'pf':>4} {'GPU hit':>8} {'cache hit':>9} {'moved GiB':>10} {'saved s':>9}")
+    for r in results:
+        pf = "-" if r["prefetch"] is None else f"{r['prefetch']:.2f}"
+        print(
+            f"{r['gpu_capacity']:>10} {r['host_capacity']:>10} {r['policy']:>6} {pf:>4} "
+            f"{r['gpu_hit_rate']:>8.1%} {r['cache_hit_rate']:>9.1%} "
+            f"{r['bytes_moved'] / 2**30:>10.1f} {r['net_prefill_saved_ms'] / 1000:>9.1f}"
+        )
+
+    if len(args.policy) > 1:
+        print_policy_comparison([r for r in results if r["prefetch"] is None])
+    if args.prefetch:
+        print_prefetch_comparison(results)
+
+    if args.output:
+        write_results(args.output, results)
+        print(f"📝 Saved {len(results)} rows to {args.output}", file=sys.stderr)
+
+
+def print_policy_comparison(results):
+    """For each cache size, the policy with the best GPU hit rate and its margin over LRU."""
+    print("\n--- Policy comparison ---")
+    by_size = {}
+    for r in results:
+        by_size.setdefault((r["gpu_capacity"], r["host_capacity"]), []).append(r)
+
+    for (gpu, host), rows in by_size.items():
+        best = max(rows, key=lambda r: r["gpu_hit_rate"])
+        line = f"GPU={gpu} HOST={host}: best={best['policy']} ({best['gpu_hit_rate']:.1%})"
+        lru = next((r for r in rows if r["policy"] == "lru"), None)
+        if lru is not None:
+            for r in rows:
+                if r is not lru:
+                    line += f", {r['policy']} vs lru {100 * (r['gpu_hit_rate'] - lru['gpu_hit_rate']):+.1f}pt"
+        print(line)
+
+
+def print_prefetch_comparison(results):
+    """GPU hit-rate gain of each prefetch threshold over no prefetch, against the bytes it wasted."""
+    print("\n--- Prefetch comparison ---")
+    baselines = {
+        (r["gpu_capacity"], r["host_capacity"], r["policy"]): r
+        for r in results if r["prefetch"] is None
+    }
+    for r in results:
+        if r["prefetch"] is None:
+            continue
+        base = baselines[(r["gpu_capacity"], r["host_capacity"], r["policy"])]
+        print(
+            f"GPU={r['gpu_capacity']} HOST={r['host_capacity']} {r['policy']} threshold={r['prefetch']:.2f}: "
+            f"GPU hit {100 * (r['gpu_hit_rate'] - base['gpu_hit_rate']):+.1f}pt, "
+            f"accuracy {r['prefetch_accuracy']:.1%}, "
+            f"prefetched {r['prefetch_bytes'] / 2**30:.1f} GiB, wasted {r['prefetch_wasted_bytes'] / 2**30:.1f} GiB"
+        )
+
+
+def write_results(path, results):
+    if path.endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r) + "\n")
+        return
+
+    fieldnames = []
+    for r in results:
+        fieldnames += [k for k in r if k not in fieldnames]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval=0)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+Snapshot / restore of a RAGCacheSimulator (Knowledge Tree, tier residency, clocks).
+
+  save_snapshot(sim, "cache.snap")
+  sim = load_snapshot("cache.snap", verbose=False)
+
+File layout (little-endian):
+
+  b"RAGCSNAP" | u32 version | u64 header length | header (JSON)
+  | children (i32) | doc (i32) | size (i64) | cost (f64) | frequency (i64)
+  | priority (f64) | last_access (i64) | flags (u8)
+
+Nodes are stored in BFS order (ROOT first) with their number of children, so
+the children of every node are one contiguous run and the tree is rebuilt in a
+single pass without parent lookups. doc is an index into the doc-id table in
+the header; flags hold the location (0 DISK, 1 HOST, 2 GPU), bit 2 =
+prefetched and bit 3 = stored (the KV was written to some tier). Policies with
+ordered lists (ARC: T1/T2 and the ghost lists B1/B2) keep them in the header as
+row numbers.
+
+Loading creates only the nodes that the tiers and policies refer to, plus their
+ancestors; every other node is created from the columns when it is first
+looked up (see _Deferred), so the load time does not grow with the cold part of
+the tree. When most nodes are resident, all of them are created in one pass.
+"""
+import gc
+import json
+import re
+import struct
+import sys
+import warnings
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, chain, repeat
+from operator import attrgetter
+
+from main import Node, RAGCacheSimulator, _SMALL_CHILDREN
+
+
+MAGIC = b"RAGCSNAP"
+VERSION = 3
+
+_LOCATIONS = ("DISK", "HOST", "GPU")
+_LOCATION_CODE = {name: i for i, name in enumerate(_LOCATIONS)}
+_PREFETCHED = 4
+_STORED = 8
+# flags の列を bytes.translate で配置だけにし、GPU / HOST の行を正規表現で拾う
+_LOCATION_TABLE = bytes(i & 3 for i in range(256))
+_RESIDENT = re.compile(rb"[\x01\x02]")
+
+# (列名, array の型コード)。i/q/d/B は主要プラットフォームで 4/8/8/1 バイト
+_COLUMNS = (
+    ("children", "i"), ("doc", "i"), ("size", "q"), ("cost", "d"), ("frequency", "q"),
+    ("priority", "d"), ("last_access", "q"), ("flags", "B"),
+)
+
+
+def save_snapshot(sim, path):
+    """
+    Writes the whole cache state of sim to path. Returns the number of nodes.
+    Children still deferred by load_snapshot are created while walking the tree.
+    """
+    columns = {name: array(code) for name, code in _COLUMNS}
+    children_col, doc_col = columns["children"], columns["doc"]
+    size_col, cost_col, freq_col = columns["size"], columns["cost"], columns["frequency"]
+    prio_col, last_col, flags_col = columns["priority"], columns["last_access"], columns["flags"]
+
+    doc_ids = []
+    doc_index = {}
+    order = [sim.root]
+    # BFS: order が伸びていく間に走査する（各ノードの子は連続した位置に積まれる）
+    for node in order:
+        doc_id = node.doc_id
+        idx = doc_index.get(doc_id)
+        if idx is None:
+            idx = doc_index[doc_id] = len(doc_ids)
+            doc_ids.append(doc_id)
+
+        doc_col.append(idx)
+        size_col.append(node.size)
+        cost_col.append(node.cost)
+        freq_col.append(node.frequency)
+        prio_col.append(node.priority)
+        last_col.append(node.last_access)
+        flags_col.append(
+            _LOCATION_CODE[node.location] | (_PREFETCHED if node.prefetched else 0) | (_STORED if node.stored else 0)
+        )
+
+        children = node.iter_children()
+        children_col.append(len(children))
+        order.extend(children)
+
+    tiers = {}
+    row_of = None
+    for tier in (sim.gpu, sim.host):
+        entry = tiers[tier.name] = {
+            "capacity": tier.capacity,
+            "policy": tier.policy.name,
+            "state": tier.policy.state(),
+            "hits": tier.hits,
+            "misses": tier.misses,
+        }
+        lists = tier.policy.lists()
+        if lists:
+            if row_of is None:
+                row_of = {node: i for i, node in enumerate(order)}
+            # 木から外されたノードは二度と挿入されないので落とす
+            entry["lists"] = {
+                key: [row_of[node] for node in nodes if node in row_of] for key, nodes in lists.items()
+            }
+
+    header = {
+        "nodes": len(order),
+        "doc_ids": doc_ids,
+        "clock": sim.clock,
+        "tiers": tiers,
+        "counters": {
+            "disk_hits": sim.disk_hits,
+            "disk_misses": sim.disk_misses,
+            "gpu_bypass": sim.gpu_bypass,
+            "prefill_ms": sim.prefill_ms,
+            "prefill_saved_ms": sim.prefill_saved_ms,
+            "reload_ms": sim.reload_ms,
+            "bytes_moved": sim.bytes_moved,
+            "transfer_time": sim.transfer_time,
+        },
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<IQ", VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, _ in _COLUMNS:
+            column = columns[name]
+            if sys.byteorder == "big":
+                column.byteswap()
+            column.tofile(f)
+    return len(order)
+
+
+def load_snapshot(path, **kwargs):
+    """
+    Rebuilds a RAGCacheSimulator from a snapshot.
+
+    Capacities and policies come from the snapshot unless given in kwargs; the
+    remaining kwargs (verbose, doc_tokens, cost_model, prefetcher, events, ...)
+    are passed to RAGCacheSimulator as usual.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a RAGCache snapshot")
+        version, header_len = struct.unpack("<IQ", f.read(12))
+        if version not in (1, 2, VERSION):
+            raise ValueError(f"Unsupported snapshot version {version} (expected {VERSION})")
+        header = json.loads(f.read(header_len))
+
+        n = header["nodes"]
+        columns = {}
+        for name, code in _COLUMNS:
+            column = array(code)
+            column.fromfile(f, n)
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns[name] = column
+
+    if version == 1:
+        # v1 には stored がない。当時の判定（GPU / HOST にある、または 2 回以上アクセス済み）で補う
+        flags = columns["flags"]
+        for i, frequency in enumerate(columns["frequency"]):
+            if flags[i] & 3 or frequency > 1:
+                flags[i] |= _STORED
+
+    tiers = header["tiers"]
+    kwargs.setdefault("gpu_capacity", tiers["GPU"]["capacity"])
+    kwargs.setdefault("host_capacity", tiers["HOST"]["capacity"])
+    kwargs.setdefault("policy", tiers["GPU"]["policy"])
+    sim = RAGCacheSimulator(**kwargs)
+
+    # ポリシーのリストは保存時と同じポリシーで復元するときだけ使う
+    lists = {}
+    unlisted = []
+    for tier in (sim.gpu, sim.host):
+        entry = tiers[tier.name]
+        if "lists" in entry and tier.policy.name == entry["policy"]:
+            lists[tier.name] = entry["lists"]
+        elif tier.policy.name == "arc" == entry["policy"]:
+            unlisted.append(tier.name)
+    if unlisted:
+        warnings.warn(
+            f"{path} (version {version}) has no ARC lists for {'/'.join(unlisted)}: T1/T2 are rebuilt "
+            f"from access counts and the ghost lists start empty", stacklevel=2,
+        )
+
+    doc_ids = [sys.intern(d) if type(d) is str else d for d in header["doc_ids"]]
+    extra = [i for tier_lists in lists.values() for key in tier_lists for i in tier_lists[key]]
+    # 数百万オブジェクトを一気に作ることがあるので、その間は循環GCを止める（木のノードは走査対象が多く重い）
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        made, gpu_resident, host_resident = _build_tree(sim, doc_ids, columns, extra)
+
+        # 階層ごとの使用量を数え直し、ポリシーの索引を作り直す
+        for tier, resident in ((sim.gpu, gpu_resident), (sim.host, host_resident)):
+            entry = tiers[tier.name]
+            tier.usage += sum(map(attrgetter("size"), resident))
+            tier.nodes = len(resident)
+            tier.hits = entry["hits"]
+            tier.misses = entry["misses"]
+            if tier.name in lists:
+                tier_lists = {key: [made[i] for i in idx] for key, idx in lists[tier.name].items()}
+                tier.policy.restore(entry["state"], resident, tier_lists)
+            else:
+                tier.policy.restore(entry["state"], resident)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    sim.clock = header["clock"]
+    counters = header["counters"]
+    sim.disk_hits = counters["disk_hits"]
+    sim.disk_misses = counters["disk_misses"]
+    sim.gpu_bypass = counters["gpu_bypass"]
+    sim.prefill_ms = counters["prefill_ms"]
+    sim.prefill_saved_ms = counters["prefill_saved_ms"]
+    sim.reload_ms = counters.get("reload_ms", 0.0)
+    sim.bytes_moved = counters["bytes_moved"]
+    sim.transfer_time = counters["transfer_time"]
+    return sim
+
+
+def _build_tree(sim, doc_ids, columns, extra):
+    """
+    Creates the nodes resident on GPU / HOST, the nodes at the row numbers in
+    extra and all their ancestors; the other children stay deferred.
+    Returns (nodes by row number, GPU resident nodes, HOST resident nodes).
+    """
+    location = columns["flags"].tobytes().translate(_LOCATION_TABLE)
+    resident = [m.start() for m in _RESIDENT.finditer(location, 1)]  # ROOT の行は除く
+    if (len(resident) + len(extra)) * 4 > len(location):
+        # 大半のノードが載っているなら、1行ずつ親を探すより全部を1パスで作る方が速い
+        return _build_all(sim, doc_ids, columns)
+
+    rows = _Rows(doc_ids, columns)
+    root = sim.root
+    root.frequency = rows.frequency[0]
+    root.last_access = rows.last_access[0]
+    root._children = _Deferred(rows, 0) if rows.counts[0] else None
+
+    # 祖先をたどって作るべき行を集める（ROOT は作成済み）
+    parents = {}
+    for i in (*resident, *extra):
+        while i and i not in parents:
+            parent = parents[i] = rows.parent(i)
+            i = parent
+
+    # BFS 順なので、行番号の昇順に作れば親は必ず先にできている
+    made = {0: root}
+    for i in sorted(parents):
+        parent = made[parents[i]]
+        made[i] = parent._children.made[i] = rows.node(parent, i)
+
+    # 子がすべてできたノードは、ふつうの子の表に置き換える
+    for i, node in made.items():
+        children = node._children
+        if children is not None and len(children.made) == rows.counts[i]:
+            node._children = children.load(node)
+
+    gpu_resident = [made[i] for i in resident if location[i] == 2]
+    host_resident = [made[i] for i in resident if location[i] == 1]
+    return made, gpu_resident, host_resident
+
+
+def _build_all(sim, doc_ids, columns):
+    """Creates every non-root node in BFS order and links children per parent (see _build_tree)."""
+    root = sim.root
+    root.frequency = columns["frequency"][0]
+    root.last_access = columns["last_access"][0]
+
+    nodes = [root]
+    counts = columns["children"]
+    # k 番目のノードを親として子の数だけ並べた列。nodes は走査中に伸びていくが、
+    # BFS 順なので親は必ず先に作られている
+    parents = chain.from_iterable(map(repeat, nodes, counts))
+    # ROOT の行を落とし、Python オブジェクトへの変換は tolist() でまとめて行う
+    rows = zip(
+        parents, map(doc_ids.__getitem__, columns["doc"][1:]),
+        columns["size"][1:].tolist(), columns["cost"][1:].tolist(),
+        columns["frequency"][1:].tolist(), columns["priority"][1:].tolist(),
+        columns["last_access"][1:].tolist(), columns["flags"][1:].tolist(),
+    )
+
+    gpu_resident = []
+    host_resident = []
+    append = nodes.append
+    new_node = Node.__new__
+    for parent, doc_id, size, cost, frequency, priority, last_access, flags in rows:
+        # __init__ を通さず、全スロットを直接埋める
+        node = new_node(Node)
+        node.doc_id = doc_id
+        node.parent = parent
+        node._children = None
+        node.size = size
+        node.cost = cost
+        node.frequency = frequency
+        node.priority = priority
+        node.last_access = last_access
+        node.gpu_children = 0
+        node.host_children = 0
+        node.heap_version = 0
+        node.pins = 0
+        node.prefetched = flags & _PREFETCHED != 0
+        node.stored = flags & _STORED != 0
+        location = flags & 3
+        if location == 2:
+            node.location = "GPU"
+            gpu_resident.append(node)
+            parent.gpu_children += 1
+        elif location == 1:
+            node.location = "HOST"
+            host_resident.append(node)
+            parent.host_children += 1
+        else:
+            node.location = "DISK"
+        append(node)
+
+    # 同じ親の子は連続しているので、親ごとにスライスして付け替える
+    start = 1
+    for parent, count in zip(nodes, counts):
+        if count:
+            end = start + count
+            if count > _SMALL_CHILDREN:
+                parent._children = {c.doc_id: c for c in nodes[start:end]}
+            else:
+                parent._children = tuple(nodes[start:end])
+            start = end
+
+    return nodes, gpu_resident, host_resident
+
+
+class _Rows:
+    """The columns of a loaded snapshot; creates the node of a row on demand."""
+
+    __slots__ = (
+        "doc_ids", "doc_index", "counts", "starts",
+        "doc", "size", "cost", "frequency", "priority", "last_access", "flags",
+    )
+
+    def __init__(self, doc_ids, columns):
+        self.doc_ids = doc_ids
+        self.doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        self.counts = columns["children"]
+        # k 行目のノードの子は starts[k] 行目から counts[k] 行（BFS 順なので連続している）
+        self.starts = array("q", accumulate(self.counts, initial=1))
+        self.doc = columns["doc"]
+        self.size = columns["size"]
+        self.cost = columns["cost"]
+        self.frequency = columns["frequency"]
+        self.priority = columns["priority"]
+        self.last_access = columns["last_access"]
+        self.flags = columns["flags"]
+
+    def parent(self, i):
+        # 子の並びが i 以前から始まる最後の行。子のない行は次の行と同じ starts なので選ばれない
+        return bisect_right(self.starts, i) - 1
+
+    def node(self, parent, i):
+        # __init__ を通さず、全スロットを直接埋める
+        node = Node.__new__(Node)
+        node.doc_id = self.doc_ids[self.doc[i]]
+        node.parent = parent
+        node._children = _Deferred(self, i) if self.counts[i] else None
+        node.size = self.size[i]
+        node.cost = self.cost[i]
+        node.frequency = self.frequency[i]
+        node.priority = self.priority[i]
+        node.last_access = self.last_access[i]
+        node.gpu_children = 0
+        node.host_children = 0
+        node.heap_version = 0
+        node.pins = 0
+        flags = self.flags[i]
+        node.prefetched = flags & _PREFETCHED != 0
+        node.stored = flags & _STORED != 0
+        location = flags & 3
+        if location == 2:
+            node.location = "GPU"
+            parent.gpu_children += 1
+        elif location == 1:
+            node.location = "HOST"
+            parent.host_children += 1
+        else:
+            node.location = "DISK"
+        return node
+
+
+class _Deferred:
+    """
+    node._children of a restored node whose children are not all created yet.
+    get() creates just the child looked up; load() creates the rest and returns
+    the ordinary children storage, which Node then keeps instead.
+    """
+
+    __slots__ = ("rows", "row", "made", "lookup")
+
+    def __init__(self, rows, row):
+        self.rows = rows
+        self.row = row
+        self.made = {}       # {行番号: 作成済みの子}
+        self.lookup = None   # 子が多いときの {doc の番号: 行番号}
+
+    def get(self, parent, doc_id):
+        rows = self.rows
+        doc = rows.doc_index.get(doc_id)
+        if doc is None:
+            return None
+        start = rows.starts[self.row]
+        end = start + rows.counts[self.row]
+        if end - start <= _SMALL_CHILDREN:
+            try:
+                i = rows.doc.index(doc, start, end)
+            except ValueError:
+                return None
+        else:
+            if self.lookup is None:
+                self.lookup = dict(zip(rows.doc[start:end], range(start, end)))
+            i = self.lookup.get(doc)
+            if i is None:
+                return None
+
+        made = self.made
+        node = made.get(i)
+        if node is None:
+            node = made[i] = rows.node(parent, i)
+            if len(made) == end - start:
+                parent._children = self.load(parent)
+        return node
+
+    def load(self, parent):
+        rows = self.rows
+        start = rows.starts[self.row]
+        made = self.made
+        children = [made.get(i) or rows.node(parent, i) for i in range(start, start + rows.counts[self.row])]
+        if len(children) > _SMALL_CHILDREN:
+            return {c.doc_id: c for c in children}
+        return tuple(children)
@@ -0,0 +1,59 @@
+import itertools
+import json
+import random
+
+
+def synthetic_trace(num_requests, num_docs=100_000, max_docs_per_request=3, zipf_s=1.1, seed=0):
+    """
+    Generates a RAG retrieval trace: one doc-id sequence per request.
+    ドキュメントの人気度は Zipf 分布（少数の文書に検索が集中する実運用に近い形）。
+    """
+    rng = random.Random(seed)
+    doc_ids = [f"D{i}" for i in range(num_docs)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank ** zipf_s) for rank in range(1, num_docs + 1)))
+
+    for _ in range(num_requests):
+        k = rng.randint(1, max_docs_per_request)
+        yield rng.choices(doc_ids, cum_weights=cum_weights, k=k)
+
+
+def take_accesses(trace, num_accesses):
+    """Truncates a trace so that the total number of document accesses is about num_accesses."""
+    seen = 0
+    for seq in trace:
+        if seen >= num_accesses:
+            return
+        seen += len(seq)
+        yield seq
+
+
+def read_trace(path, column="docs", batch_size=65536):
+    """
+    Streams a retrieval trace from disk, yielding one doc-id sequence per request.
+
+    - JSONL: 1行1リクエスト。`["D1", "D2"]` か `{"docs": ["D1", "D2"], ...}` の形式
+    - Parquet: list<string> 型の `column` 列（pyarrow が必要）
+    """
+    path = str(path)
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet traces require pyarrow: pip install pyarrow") from e
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=[column]):
+            for seq in batch.column(0).to_pylist():
+                if seq:
+                    yield seq
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            seq = record[column] if isinstance(record, dict) else record
+            if seq:
+                yield seq
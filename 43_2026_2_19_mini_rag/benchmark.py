@@ -0,0 +1,170 @@
+"""
+Path search latency and graph memory of SimpleMiniRAG.
+
+  python benchmark.py --nodes 100000 --degrees 10 100 1000
+
+  # 複数クエリ: search を1件ずつ呼ぶ場合と search_many（バッチ、プロセスプール）の比較
+  python benchmark.py --nodes 100000 --queries 1000 --workers 4
+
+  # グラフのメモリ（networkx / CSR バックエンド、辺の数ごと）
+  python benchmark.py --memory 1000000 5000000
+
+次数の異なる start node ごとに、従来の探索（2-hop 以内の全ノードに対して
+all_simple_paths で全パスを列挙してソート）と、最良優先探索の search() のレイテンシを比較する。
+従来版はハブで爆発するので --baseline-max-degree を超える次数では測らない。
+"""
+import argparse
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+
+from main import SimpleMiniRAG
+
+
+def exhaustive_search(rag, query_embedding, start_nodes, answer_candidates, top_k=3):
+    """The original search: every simple path of length <= 2, sorted by score."""
+    index, reach, weights = rag._k_hop_reach(start_nodes, answer_candidates, k=1)
+
+    def edge_score(u, v):
+        return int((reach[index[u]] | reach[index[v]]) @ weights)
+
+    paths = []
+    for start_node in start_nodes:
+        sim = float(rag.embeddings.similarity(query_embedding, [index[start_node]])[0])
+        for target in nx.single_source_shortest_path_length(rag.G, start_node, cutoff=2):
+            if target == start_node:
+                continue
+            for path in nx.all_simple_paths(rag.G, start_node, target, cutoff=2):
+                edge_sum = sum(edge_score(u, v) for u, v in zip(path, path[1:]))
+                contains_answer = sum(1 for n in path if n in answer_candidates)
+                paths.append({"path": path, "score": sim * (1 + contains_answer + edge_sum)})
+    return sorted(paths, key=lambda x: x["score"], reverse=True)[:top_k]
+
+
+def build_graph(num_nodes, edges_per_node, dim, seed):
+    rng = np.random.default_rng(seed)
+    graph = nx.barabasi_albert_graph(num_nodes, edges_per_node, seed=seed)
+    rag = SimpleMiniRAG()
+    for n in graph.nodes():
+        rag.add_entity(f"E{n}", "Concept", rng.random(dim, dtype=np.float32))
+    for u, v in graph.edges():
+        rag.add_relation(f"E{u}", f"E{v}", "related_to")
+    return rag, graph
+
+
+def _max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux は KiB 単位
+
+
+def graph_bytes_per_edge(backend, num_edges, seed):
+    """Adds num_edges random relations (5 edges per node) and returns RSS growth per edge."""
+    rng = np.random.default_rng(seed)
+    num_nodes = max(2, num_edges // 5)
+    ends = rng.integers(0, num_nodes, size=(num_edges, 2)).tolist()
+    names = [f"E{i}" for i in range(num_nodes)]
+    relations = ["related_to", "part_of", "mentions"]
+
+    rss_before = _max_rss_bytes()
+    # 近傍索引は 1-hop（隣接リスト）まで。2-hop 近傍はグラフの形で大きさが大きく変わるので含めない
+    rag = SimpleMiniRAG(index_hops=1, backend=backend)
+    for i, (u, v) in enumerate(ends):
+        rag.add_relation(names[u], names[v], relations[i % 3])
+    rag.khop.within(0, 1)
+    return (_max_rss_bytes() - rss_before) / num_edges
+
+
+def memory_benchmark(args):
+    for num_edges in args.memory:
+        for backend in ("networkx", "csr"):
+            # 辺の数ごと・バックエンドごとに新しいプロセスで測り、ピークRSSの増分を比較する
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                per_edge = pool.submit(graph_bytes_per_edge, backend, num_edges, args.seed).result()
+            print(f"{num_edges:>11,} edges {backend:>8}: {per_edge:6.1f} B/edge, "
+                  f"{per_edge * num_edges / 2**30:6.2f} GiB total")
+
+
+def batch_benchmark(rag, rng, args):
+    queries = rng.random((args.queries, args.dim), dtype=np.float32)
+    rag.embeddings.prepare()  # IVF 索引の構築は計測に含めない
+    # start node / 答え候補は retrieve() で選ぶ（よく似たクエリは同じ起点を共有する）
+    start = time.perf_counter()
+    expected = [rag.search(q, top_k=args.top_k) for q in queries]
+    one_by_one = time.perf_counter() - start
+    print(f"search x {args.queries:,}: {one_by_one:.2f}s ({args.queries / one_by_one:,.0f} queries/s)")
+
+    for workers in sorted({1, args.workers or 1}):
+        start = time.perf_counter()
+        result = rag.search_many(queries, top_k=args.top_k, workers=workers)
+        elapsed = time.perf_counter() - start
+        assert [[p["path"] for p in paths] for paths in result] == [[p["path"] for p in paths] for paths in expected]
+        print(f"search_many (workers={workers}): {elapsed:.2f}s ({args.queries / elapsed:,.0f} queries/s, "
+              f"{one_by_one / elapsed:.1f}x)")
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleMiniRAG path search latency vs start-node degree")
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--edges-per-node", type=int, default=3)
+    parser.add_argument("--degrees", type=int, nargs="+", default=[10, 100, 1000],
+                        help="この次数に最も近いノードを start node にする")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-max-degree", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=0,
+                        help="指定した数のランダムなクエリで search と search_many を比較する")
+    parser.add_argument("--workers", type=int, default=None, help="search_many のプロセス数")
+    parser.add_argument("--memory", type=int, nargs="+", metavar="EDGES",
+                        help="指定した辺の数でグラフのメモリを測る")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_benchmark(args)
+        return
+
+    start = time.perf_counter()
+    rag, graph = build_graph(args.nodes, args.edges_per_node, args.dim, args.seed)
+    rag.khop.within(0, 1)  # 索引の構築も含めて測る
+    print(f"graph: {graph.number_of_nodes():,} nodes, {graph.number_of_edges():,} edges "
+          f"(max degree {max(d for _, d in graph.degree()):,}), built in {time.perf_counter() - start:.1f}s")
+
+    rng = np.random.default_rng(args.seed)
+    if args.queries:
+        batch_benchmark(rag, rng, args)
+        return
+
+    query = rng.random(args.dim, dtype=np.float32)
+    degrees = dict(graph.degree())
+    for target_degree in args.degrees:
+        n = min(degrees, key=lambda v: abs(degrees[v] - target_degree))
+        start_nodes = [f"E{n}"]
+        answer_candidates = [f"E{v}" for v in rng.choice(args.nodes, size=2, replace=False)]
+        two_hop = len(rag.khop.within(rag.khop.ids[start_nodes[0]], 2))
+
+        after, result = timed(lambda: rag.search(query, start_nodes, answer_candidates, args.top_k), args.repeat)
+        line = f"degree {degrees[n]:>6,} (2-hop {two_hop:>7,}): best-first {after * 1000:8.2f} ms"
+        if degrees[n] <= args.baseline_max_degree:
+            before, expected = timed(
+                lambda: exhaustive_search(rag, query, start_nodes, answer_candidates, args.top_k), 1)
+            assert np.allclose([p["score"] for p in result], [p["score"] for p in expected])
+            line += f", all_simple_paths {before * 1000:10.2f} ms ({before / after:,.0f}x)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Bulk construction of a SimpleMiniRAG graph from entity / chunk / relation tables.
+
+  # Parquet / JSONL をバッチごとに読み込み、グラフと埋め込み行列を1パスで作る
+  python bulk_load.py --entities entities.parquet --chunks chunks.parquet --relations relations.parquet --backend csr
+
+  # 合成データを書き出して、そのまま読み込む（--format jsonl / parquet）
+  python bulk_load.py --synthetic 1000000 --synthetic-dir data/ --format parquet --backend csr
+
+Tables (JSONL は1行1レコードの dict、Parquet は同名の列):
+
+  entities:  id, entity_type, embedding (list<float>)
+  chunks:    id, content, embedding (list<float>)
+  relations: source, target, relation, description (省略可)
+
+同じ id のエンティティは最初の1件だけを使う（グラフに既にあるエンティティも読み飛ばす）。
+テーブルごとに行数と rows/sec を出力する。
+"""
+import argparse
+import json
+import os
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from main import ENTITY, SimpleMiniRAG
+
+
+ENTITY_COLUMNS = ("id", "entity_type", "embedding")
+CHUNK_COLUMNS = ("id", "content", "embedding")
+RELATION_COLUMNS = ("source", "target", "relation", "description")
+
+
+def read_batches(path, columns, batch_size=65536):
+    """
+    Streams a table as {column: values} batches of up to batch_size rows.
+
+    "embedding" は (行数, 次元) の float32 配列、それ以外はリスト。ファイルにない列は None で埋める。
+    Parquet は pyarrow が必要。
+    """
+    path = str(path)
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet tables require pyarrow: pip install pyarrow") from e
+
+        parquet_file = pq.ParquetFile(path)
+        present = [c for c in columns if c in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=present):
+            values = {}
+            for name in columns:
+                if name not in present:
+                    values[name] = [None] * batch.num_rows
+                elif name == "embedding":
+                    # list<float> の中身を1本の配列として取り出す（行ごとの Python リストを作らない）
+                    flat = batch.column(name).flatten().to_numpy(zero_copy_only=False)
+                    values[name] = flat.astype(np.float32, copy=False).reshape(batch.num_rows, -1)
+                else:
+                    values[name] = batch.column(name).to_pylist()
+            yield values
+        return
+
+    with open(path, encoding="utf-8") as f:
+        records = []
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+            if len(records) == batch_size:
+                yield _columns_of(records, columns)
+                records = []
+        if records:
+            yield _columns_of(records, columns)
+
+
+def _columns_of(records, columns):
+    values = {name: [record.get(name) for record in records] for name in columns}
+    if "embedding" in values:
+        values["embedding"] = np.array(values["embedding"], dtype=np.float32)
+    return values
+
+
+def load_entities(rag, path, batch_size=65536):
+    """Adds the entities of a table (first row per id). Returns (rows read, entities added)."""
+    size = rag.embeddings.size
+    existing = np.flatnonzero(rag.embeddings.kinds[:size] == ENTITY).tolist()
+    seen = set(map(rag.khop.nodes.__getitem__, existing))
+    rows = added = 0
+    for batch in read_batches(path, ENTITY_COLUMNS, batch_size):
+        ids = batch["id"]
+        rows += len(ids)
+        keep = []
+        for pos, entity_id in enumerate(ids):
+            if entity_id not in seen:
+                seen.add(entity_id)
+                keep.append(pos)
+        if len(keep) < len(ids):
+            types = batch["entity_type"]
+            ids, types = [ids[p] for p in keep], [types[p] for p in keep]
+            embeddings = batch["embedding"][keep]
+        else:
+            types, embeddings = batch["entity_type"], batch["embedding"]
+        rag.add_entities(ids, types, embeddings)
+        added += len(ids)
+    return rows, added
+
+
+def load_chunks(rag, path, batch_size=65536):
+    """Adds the chunks of a table. Returns (rows read, chunks added)."""
+    rows = 0
+    for batch in read_batches(path, CHUNK_COLUMNS, batch_size):
+        rag.add_chunks(batch["id"], batch["content"], batch["embedding"])
+        rows += len(batch["id"])
+    return rows, rows
+
+
+def load_relations(rag, path, batch_size=65536):
+    """Adds the relations of a table. Returns (rows read, new edges)."""
+    rows = 0
+    edges_before = rag.G.number_of_edges()
+    for batch in read_batches(path, RELATION_COLUMNS, batch_size):
+        descriptions = ["" if d is None else d for d in batch["description"]]
+        rag.add_relations(batch["source"], batch["target"], batch["relation"], descriptions)
+        rows += len(batch["source"])
+    return rows, rag.G.number_of_edges() - edges_before
+
+
+def bulk_load(rag, entities=None, chunks=None, relations=None, batch_size=65536):
+    """
+    Loads the given tables into rag (entities, then chunks, then relations) and
+    builds the k-hop / IVF indexes once at the end.
+
+    Returns {step: {"rows", "added", "seconds"}} for each table and "index".
+    """
+    stats = {}
+    for name, path, loader in (
+        ("entities", entities, load_entities),
+        ("chunks", chunks, load_chunks),
+        ("relations", relations, load_relations),
+    ):
+        if path is None:
+            continue
+        start = time.perf_counter()
+        rows, added = loader(rag, path, batch_size)
+        stats[name] = {"rows": rows, "added": added, "seconds": time.perf_counter() - start}
+
+    # 辺を1本ずつ反映せず、k-hop 近傍はスパース行列の積でまとめて作る
+    start = time.perf_counter()
+    rag.khop.rebuild()
+    rag.embeddings.prepare()
+    stats["index"] = {"rows": 0, "added": 0, "seconds": time.perf_counter() - start}
+    return stats
+
+
+def write_synthetic(directory, num_entities, fmt="jsonl", dim=64, chunks_per_entity=0.5,
+                    relations_per_entity=5, duplicate_rate=0.05, seed=0, batch_size=65536):
+    """
+    Writes synthetic entities / chunks / relations tables (duplicate_rate of the entity
+    rows repeat an earlier id). Returns the three paths.
+    """
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing Parquet requires pyarrow: pip install pyarrow") from e
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    num_chunks = int(num_entities * chunks_per_entity)
+    num_relations = int(num_entities * relations_per_entity)
+    relation_types = np.array(["related_to", "part_of", "mentions"])
+
+    def entity_rows(start, end):
+        ids = np.arange(start, end)
+        duplicates = rng.random(len(ids)) < duplicate_rate
+        ids[duplicates] = rng.integers(0, np.maximum(ids[duplicates], 1))
+        return {
+            "id": [f"E{i}" for i in ids.tolist()],
+            "entity_type": [f"Type{i % 16}" for i in ids.tolist()],
+            "embedding": rng.random((len(ids), dim), dtype=np.float32),
+        }
+
+    def chunk_rows(start, end):
+        return {
+            "id": [f"C{i}" for i in range(start, end)],
+            "content": [f"chunk text {i}" for i in range(start, end)],
+            "embedding": rng.random((end - start, dim), dtype=np.float32),
+        }
+
+    def relation_rows(start, end):
+        n = end - start
+        # 一部のエンティティに辺が集まるように、始点は冪分布で選ぶ
+        sources = np.minimum((rng.pareto(1.2, n) * 10).astype(np.int64), num_entities - 1)
+        to_chunk = rng.random(n) < 0.3
+        targets = rng.integers(0, num_entities, n)
+        return {
+            "source": [f"E{i}" for i in sources.tolist()],
+            "target": [f"C{t % max(num_chunks, 1)}" if c else f"E{t}"
+                       for t, c in zip(targets.tolist(), to_chunk.tolist())],
+            "relation": relation_types[rng.integers(0, 3, n)].tolist(),
+            "description": [""] * n,
+        }
+
+    paths = []
+    for name, total, make_rows in (
+        ("entities", num_entities, entity_rows),
+        ("chunks", num_chunks, chunk_rows),
+        ("relations", num_relations, relation_rows),
+    ):
+        path = os.path.join(directory, f"{name}.{fmt}")
+        writer = None
+        with open(path, "w", encoding="utf-8") if fmt == "jsonl" else nullcontext() as f:
+            for start in range(0, total, batch_size):
+                rows = make_rows(start, min(total, start + batch_size))
+                if fmt == "jsonl":
+                    if "embedding" in rows:
+                        rows["embedding"] = rows["embedding"].tolist()
+                    names = list(rows)
+                    for values in zip(*(rows[n] for n in names)):
+                        f.write(json.dumps(dict(zip(names, values))) + "\n")
+                else:
+                    columns = {}
+                    for column, values in rows.items():
+                        if column == "embedding":
+                            values = pa.FixedSizeListArray.from_arrays(pa.array(values.ravel()), dim)
+                        columns[column] = values
+                    table = pa.table(columns)
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+        if writer is not None:
+            writer.close()
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load entity / chunk / relation tables into SimpleMiniRAG")
+    parser.add_argument("--entities", help="entities の .jsonl / .parquet")
+    parser.add_argument("--chunks", help="chunks の .jsonl / .parquet")
+    parser.add_argument("--relations", help="relations の .jsonl / .parquet")
+    parser.add_argument("--backend", choices=["networkx", "csr"], default="csr")
+    parser.add_argument("--index-hops", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=65536)
+    parser.add_argument("--synthetic", type=int, metavar="ENTITIES",
+                        help="指定した数のエンティティの合成データを書き出して読み込む")
+    parser.add_argument("--synthetic-dir", default="synthetic_corpus")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        start = time.perf_counter()
+        args.entities, args.chunks, args.relations = write_synthetic(
+            args.synthetic_dir, args.synthetic, fmt=args.format, dim=args.dim, seed=args.seed)
+        print(f"wrote synthetic tables to {args.synthetic_dir}/ in {time.perf_counter() - start:.1f}s")
+    if not (args.entities or args.chunks or args.relations):
+        parser.error("give --entities / --chunks / --relations or --synthetic")
+
+    rag = SimpleMiniRAG(index_hops=args.index_hops, backend=args.backend)
+    stats = bulk_load(rag, args.entities, args.chunks, args.relations, batch_size=args.batch_size)
+
+    total_rows = sum(s["rows"] for s in stats.values())
+    total_seconds = sum(s["seconds"] for s in stats.values())
+    for name, s in stats.items():
+        if name == "index":
+            print(f"{'index':>10}: built in {s['seconds']:.2f}s")
+            continue
+        print(f"{name:>10}: {s['rows']:>12,} rows ({s['added']:,} added) in {s['seconds']:7.2f}s "
+              f"({s['rows'] / max(s['seconds'], 1e-9):,.0f} rows/s)")
+    print(f"{'total':>10}: {total_rows:>12,} rows in {total_seconds:7.2f}s "
+          f"({total_rows / max(total_seconds, 1e-9):,.0f} rows/s); graph {rag.G.number_of_nodes():,} nodes, "
+          f"{rag.G.number_of_edges():,} edges")
+
+
+if __name__ == "__main__":
+    main()
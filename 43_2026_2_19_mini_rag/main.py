@@ -1,135 +1,954 @@
+import heapq
+import itertools
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
 import networkx as nx
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
+
+class _SortedIdSets:
+    """ノードIDごとの昇順ID配列。まとめて CSR（indptr, indices）に持ち、更新されたノードだけ dict に持つ"""
 
-class SimpleMiniRAG:
     def __init__(self):
-        # 異種グラフの初期化
-        self.G = nx.Graph()
-        # エンティティとチャンクの埋め込み（シミュレーション用）
-        self.embeddings = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.updated = {}
+        self._updated_size = 0
+
+    def get(self, i):
+        ids = self.updated.get(i)
+        if ids is not None:
+            return ids
+        if i + 1 < len(self.indptr):
+            return self.indices[self.indptr[i]:self.indptr[i + 1]]
+        # CSR を作った後に追加されたノード（まだ辺がない）
+        return np.array([i], dtype=np.int32)
+
+    def set(self, i, ids):
+        self.updated[i] = ids
+        self._updated_size += len(ids)
+
+    def compact_if_needed(self, num_nodes):
+        # 更新分が CSR 本体に比べて大きくなったら詰め直す
+        if self._updated_size > len(self.indices) // 2 + 4096:
+            self.load([self.get(i) for i in range(num_nodes)])
+
+    def load(self, arrays):
+        lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+        self.indptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.indices = np.concatenate(arrays).astype(np.int32) if arrays else np.zeros(0, dtype=np.int32)
+        self.updated = {}
+        self._updated_size = 0
+
+    def load_csr(self, matrix):
+        matrix.sort_indices()
+        self.indptr = matrix.indptr.astype(np.int64)
+        self.indices = matrix.indices.astype(np.int32)
+        self.updated = {}
+        self._updated_size = 0
+
+
+class KHopIndex:
+    """
+    k-hop 近傍の索引: ノードごとに「j-hop 以内にあるノードID」（自身を含む）を
+    j = 1..max_hops について昇順の配列で持つ。
+
+    辺 (u, v) の追加で縮む距離は u 側と v 側をつなぐものだけなので、
+    u から d-hop のノード x に v の (j-1-d)-hop 近傍を足せば j-hop 近傍が更新できる。
+    追加された辺は次に近傍を参照したときに反映し、辺の数に比べて多ければ
+    rebuild() でスパース行列の積からまとめて作り直す。
+    """
+
+    def __init__(self, max_hops=2):
+        self.max_hops = max_hops
+        self.ids = {}    # ノード -> ID（追加順）
+        self.nodes = []  # ID -> ノード
+        # levels[j - 1]: j-hop 以内のノードID
+        self.levels = [_SortedIdSets() for _ in range(max_hops)]
+        # 辺の両端のID（小さいIDが先。nx.Graph.edges() と同じ向き）。1辺 8 バイト
+        self._edge_u = array("i")
+        self._edge_v = array("i")
+        self._edge_arrays = None
+        # 近傍に反映済みの辺の数（それ以降の辺は次の参照時に反映する）
+        self._applied = 0
+
+    def add_node(self, node):
+        i = self.ids.get(node)
+        if i is None:
+            i = self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return i
+
+    def add_nodes(self, nodes):
+        """add_node() の一括版。ID の配列を返す"""
+        return np.fromiter(map(self.add_node, nodes), dtype=np.int64, count=len(nodes))
+
+    def within(self, i, k):
+        """ID i から k-hop 以内のノードID（昇順、k <= max_hops）"""
+        if self._applied < len(self._edge_u):
+            self._apply_pending()
+        if k == 0:
+            return np.array([i], dtype=np.int32)
+        return self.levels[k - 1].get(i)
+
+    def add_edge(self, u, v):
+        """新しい辺 (u, v) を登録する（既存の辺かどうかは呼び出し側で確認する）"""
+        a, b = self.add_node(u), self.add_node(v)
+        self._edge_u.append(min(a, b))
+        self._edge_v.append(max(a, b))
+        self._edge_arrays = None
+        # 近傍の更新は次の参照時にまとめて行う
+
+    def add_edges(self, a, b):
+        """新しい辺をまとめて登録する（add_edge() の一括版。a, b はノードIDの配列）"""
+        a, b = np.asarray(a, dtype=np.int32), np.asarray(b, dtype=np.int32)
+        self._edge_u.frombytes(np.minimum(a, b).tobytes())
+        self._edge_v.frombytes(np.maximum(a, b).tobytes())
+        self._edge_arrays = None
+
+    def _apply_pending(self):
+        start, end = self._applied, len(self._edge_u)
+        self._applied = end
+        # ハブに触れる辺の差分更新は重いので、まとめて追加された辺は作り直した方が速い
+        if end - start > end // 1000 + 16:
+            self.rebuild()
+            return
+        for a, b in zip(self._edge_u[start:end], self._edge_v[start:end]):
+            if a != b:
+                self._apply_edge(a, b)
+        for level in self.levels:
+            level.compact_if_needed(len(self.nodes))
+
+    def _apply_edge(self, a, b):
+        # 更新前の近傍だけを読んで差分を集めてから、まとめて反映する
+        additions = {}
+        for src, dst in ((a, b), (b, a)):
+            inner = np.zeros(0, dtype=np.int32)
+            for d in range(self.max_hops):
+                reach = self.within(src, d)
+                ring = np.setdiff1d(reach, inner, assume_unique=True)  # src からちょうど d-hop
+                inner = reach
+                for j in range(d + 1, self.max_hops + 1):
+                    extra = self.within(dst, j - 1 - d)
+                    for x in ring.tolist():
+                        additions.setdefault((x, j), []).append(extra)
+
+        for (x, j), extras in additions.items():
+            level = self.levels[j - 1]
+            level.set(x, np.unique(np.concatenate([level.get(x), *extras])))
+
+    def edges(self):
+        """辺の両端のID配列 (edge_u, edge_v)"""
+        if self._edge_arrays is None:
+            self._edge_arrays = (
+                np.frombuffer(self._edge_u, dtype=np.int32).copy(),
+                np.frombuffer(self._edge_v, dtype=np.int32).copy(),
+            )
+        return self._edge_arrays
+
+    def adjacency(self):
+        """隣接行列（CSR, float32, 対称）"""
+        edge_u, edge_v = self.edges()
+        n = len(self.nodes)
+        ones = np.ones(len(edge_u), dtype=np.float32)
+        adj = sp.coo_matrix((ones, (edge_u, edge_v)), shape=(n, n))
+        return (adj + adj.T).tocsr()
+
+    def rebuild(self):
+        """全ノードの近傍を (A + I)^j の非ゼロ構造から作り直す"""
+        self._applied = len(self._edge_u)
+        adj = self.adjacency()
+        step = (adj + sp.identity(len(self.nodes), dtype=np.float32, format="csr")).tocsr()
+        step.data[:] = 1
+        reach = step
+        for j, level in enumerate(self.levels):
+            if j:
+                reach = reach @ step
+                reach.data[:] = 1  # 経路数ではなく到達の有無だけを使う
+            level.load_csr(reach.tocsr())
+
+
+class _StringTable:
+    """文字列 <-> 整数コード（同じ文字列は1つだけ持つ）"""
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def code(self, s):
+        c = self.codes.get(s)
+        if c is None:
+            c = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return c
+
+    def codes_of(self, strings):
+        return np.fromiter(map(self.code, strings), dtype=np.int32, count=len(strings))
+
+
+class _EdgeKeys:
+    """
+    辺 (a, b) -> 辺番号。キー a * 2^32 + b を昇順の run（配列）に分けて持ち、
+    最近1件ずつ追加した分は dict に持つ。run は後ろほど小さく、直前の run の半分を超えたら併合する
+    （まとめて追加しても併合のコストは全体で O(辺数 log 辺数) に収まる）。
+    """
+
+    def __init__(self):
+        self.runs = []  # [(keys, positions)]
+        self.recent = {}
+
+    @staticmethod
+    def key(a, b):
+        return (min(a, b) << 32) | max(a, b)
+
+    @staticmethod
+    def keys_of(a, b):
+        """key() の配列版"""
+        a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+        return (np.minimum(a, b) << 32) | np.maximum(a, b)
+
+    def find(self, key):
+        pos = self.recent.get(key)
+        if pos is not None:
+            return pos
+        for keys, positions in self.runs:
+            i = np.searchsorted(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return int(positions[i])
+        return -1
+
+    def find_many(self, keys):
+        """find() の配列版（見つからなければ -1）"""
+        if self.recent:
+            self._push_run(np.fromiter(self.recent.keys(), dtype=np.int64),
+                           np.fromiter(self.recent.values(), dtype=np.int64))
+            self.recent = {}
+        found = np.full(len(keys), -1, dtype=np.int64)
+        for run_keys, positions in self.runs:
+            i = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            hit = run_keys[i] == keys
+            found[hit] = positions[i[hit]]
+        return found
+
+    def add(self, key, pos):
+        self.recent[key] = pos
+        if len(self.recent) >= 65536:
+            self._push_run(np.fromiter(self.recent.keys(), dtype=np.int64),
+                           np.fromiter(self.recent.values(), dtype=np.int64))
+            self.recent = {}
+
+    def add_many(self, keys, positions):
+        """まだない辺のキー（重複なし）と辺番号をまとめて追加する"""
+        if len(keys):
+            self._push_run(np.asarray(keys, dtype=np.int64), np.asarray(positions, dtype=np.int64))
+
+    def _push_run(self, keys, positions):
+        order = np.argsort(keys, kind="stable")
+        self.runs.append((keys[order], positions[order]))
+        while len(self.runs) > 1 and len(self.runs[-2][0]) <= 2 * len(self.runs[-1][0]):
+            (keys_a, pos_a), (keys_b, pos_b) = self.runs[-2:]
+            keys = np.concatenate((keys_a, keys_b))
+            positions = np.concatenate((pos_a, pos_b))
+            # 昇順の列2本の連結なので、安定ソート（timsort）はほぼ線形で済む
+            order = np.argsort(keys, kind="stable")
+            self.runs[-2:] = [(keys[order], positions[order])]
+
+
+class CSRGraph:
+    """
+    networkx.Graph の代わりに使う省メモリなグラフ（SimpleMiniRAG(backend="csr")）。
+
+    ノードIDと辺の両端は KHopIndex と共有し（ノード名 -> 整数IDの表、辺は int32 の配列）、
+    ここではノードの種類・属性と、辺の relation / desc を整数コードの列で持つ。
+    文字列は _StringTable で共有するので、1-hop の索引（index_hops=1）込みで1辺あたり 110〜140 バイト程度
+    （networkx は 370〜380 バイト程度）。2-hop の索引はハブの次数の2乗で大きくなるので含めない。
+    SimpleMiniRAG が使う networkx の API（add_node, add_edge, has_edge, nodes[n], ...）だけを持つ。
+    """
+
+    _TYPES = (None, "entity", "chunk")
+
+    def __init__(self, khop):
+        self.khop = khop
+        self.strings = _StringTable()
+        self.contents = []  # チャンク本文（ほぼ重複しないので共有しない）
+        # ノードID ごとの列
+        self._node_type = array("b")
+        self._node_attr = array("i")  # entity: entity_type のコード, chunk: contents の番号
+        # 辺番号（KHopIndex の辺の順）ごとの列
+        self._relation = array("i")
+        self._desc = array("i")
+        self._edge_keys = _EdgeKeys()
+        self.nodes = _CSRNodeView(self)
+
+    def _ensure_node(self, node):
+        i = self.khop.add_node(node)
+        while len(self._node_type) <= i:
+            self._node_type.append(0)
+            self._node_attr.append(-1)
+        return i
+
+    def _grow_nodes(self):
+        # KHopIndex に直接追加されたノードの分だけ列を伸ばす
+        missing = len(self.khop.nodes) - len(self._node_type)
+        if missing > 0:
+            self._node_type.frombytes(bytes(missing))
+            self._node_attr.frombytes(np.full(missing, -1, dtype=np.int32).tobytes())
+
+    def add_node(self, node, type=None, content=None, entity_type=None):
+        i = self._ensure_node(node)
+        if type == "chunk":
+            self._node_type[i] = 2
+            self._node_attr[i] = len(self.contents)
+            self.contents.append(content)
+        elif type == "entity":
+            self._node_type[i] = 1
+            self._node_attr[i] = self.strings.code(entity_type)
+
+    def add_edge(self, u, v, relation=None, desc=""):
+        """
+        辺を追加する（既にあれば属性だけ更新する）。
+        新しい辺は、呼び出し側が同じ順で KHopIndex.add_edge() に渡す。
+        """
+        a, b = self._ensure_node(u), self._ensure_node(v)
+        key = _EdgeKeys.key(a, b)
+        pos = self._edge_keys.find(key)
+        if pos < 0:
+            pos = len(self._relation)
+            self._relation.append(self.strings.code(relation))
+            self._desc.append(self.strings.code(desc))
+            self._edge_keys.add(key, pos)
+        else:
+            self._relation[pos] = self.strings.code(relation)
+            self._desc[pos] = self.strings.code(desc)
+
+    def add_nodes_from(self, nodes):
+        """(node, 属性の dict) の列をまとめて追加する（networkx と同じ形）"""
+        for node, attrs in nodes:
+            self.add_node(node, **attrs)
+
+    def add_edges(self, a, b, relations, descs):
+        """
+        add_edge() の配列版（a, b はノードID）。新しい辺（同じ辺が並んでいれば最初の1本）を示す
+        bool 配列を返し、呼び出し側がその順で KHopIndex.add_edges() に渡す。
+        同じ辺が複数あれば、属性は最後のものになる。
+        """
+        self._grow_nodes()
+        keys = _EdgeKeys.keys_of(a, b)
+        pos = self._edge_keys.find_many(keys)
+        missing = np.flatnonzero(pos < 0)
+        new_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+        # 新しい辺には、バッチ内で最初に現れた順に辺番号を振る
+        rank = np.empty(len(new_keys), dtype=np.int64)
+        rank[np.argsort(first)] = np.arange(len(new_keys))
+        start = len(self._relation)
+        pos[missing] = start + rank[inverse.ravel()]
+        self._edge_keys.add_many(new_keys, start + rank)
+        padding = np.zeros(len(new_keys), dtype=np.int32).tobytes()
+        self._relation.frombytes(padding)
+        self._desc.frombytes(padding)
+
+        # 辺ごとに最後の行の属性を書き込む
+        last = len(pos) - 1 - np.unique(pos[::-1], return_index=True)[1]
+        np.frombuffer(self._relation, dtype=np.int32)[pos[last]] = self.strings.codes_of(relations)[last]
+        np.frombuffer(self._desc, dtype=np.int32)[pos[last]] = self.strings.codes_of(descs)[last]
+
+        is_new = np.zeros(len(keys), dtype=bool)
+        is_new[missing[first]] = True
+        return is_new
+
+    def has_edge(self, u, v):
+        a, b = self.khop.ids.get(u), self.khop.ids.get(v)
+        if a is None or b is None:
+            return False
+        return self._edge_keys.find(_EdgeKeys.key(a, b)) >= 0
+
+    def get_edge_data(self, u, v, default=None):
+        a, b = self.khop.ids.get(u), self.khop.ids.get(v)
+        if a is None or b is None:
+            return default
+        pos = self._edge_keys.find(_EdgeKeys.key(a, b))
+        if pos < 0:
+            return default
+        strings = self.strings.strings
+        return {"relation": strings[self._relation[pos]], "desc": strings[self._desc[pos]]}
+
+    def edges(self):
+        nodes = self.khop.nodes
+        edge_u, edge_v = self.khop.edges()
+        for a, b in zip(edge_u.tolist(), edge_v.tolist()):
+            yield nodes[a], nodes[b]
+
+    def number_of_nodes(self):
+        return len(self.khop.nodes)
+
+    def number_of_edges(self):
+        return len(self._relation)
+
+    def node_attributes(self, i):
+        node_type = self._TYPES[self._node_type[i]]
+        if node_type == "chunk":
+            return {"type": node_type, "content": self.contents[self._node_attr[i]]}
+        if node_type == "entity":
+            return {"type": node_type, "entity_type": self.strings.strings[self._node_attr[i]]}
+        return {}
+
+
+class _CSRNodeView:
+    """G.nodes[n] -> 属性の dict（networkx の NodeView 相当）"""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        return self._graph.node_attributes(self._graph.khop.ids[node])
+
+    def __contains__(self, node):
+        return node in self._graph.khop.ids
+
+    def __iter__(self):
+        return iter(self._graph.khop.nodes)
+
+    def __len__(self):
+        return len(self._graph.khop.nodes)
+
+
+ENTITY, CHUNK = 1, 2
+
+
+class EmbeddingStore:
+    """
+    ノードの埋め込みを、L2正規化した float32 の連続した行列で持つ（行番号 = KHopIndex のID）。
+    内積がそのまま cosine 類似度になり、クエリとの類似度は行列積1回で求まる。
+
+    行数が ann_min_rows 以上になったら IVF（球面 k-means でクラスタに分け、
+    クエリに近い nprobe 個のクラスタだけを調べる）の近似最近傍探索に切り替える。
+    """
+
+    def __init__(self, ids, ann_min_rows=50_000, nprobe=8, seed=0):
+        self.ids = ids  # ノード -> ID（KHopIndex と共有）
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.kinds = np.zeros(0, dtype=np.int8)  # 0: 埋め込みなし, ENTITY, CHUNK
+        self.size = 0  # 使用中の行数（matrix は倍々で確保する）
+        self.ann_min_rows = ann_min_rows
+        self.nprobe = nprobe
+        self.seed = seed
+        self._ivf = None  # (centroids, lists の CSR: indptr, rows, 索引済みの行数)
+
+    def __getitem__(self, node):
+        i = self.ids.get(node)
+        if i is None or i >= self.size or not self.kinds[i]:
+            raise KeyError(node)
+        return self.matrix[i]
+
+    def __contains__(self, node):
+        i = self.ids.get(node)
+        return i is not None and i < self.size and bool(self.kinds[i])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.kinds[:self.size]))
+
+    def kind(self, i):
+        """ID i の種類（ENTITY / CHUNK、埋め込みがなければ 0）"""
+        return int(self.kinds[i]) if i < self.size else 0
+
+    def add(self, i, embedding, kind):
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        self._reserve(i + 1, len(vec))
+        norm = np.linalg.norm(vec)
+        self.matrix[i] = vec / norm if norm else vec
+        self.kinds[i] = kind
+        self.size = max(self.size, i + 1)
+
+    def add_many(self, ids, embeddings, kind):
+        """add() の一括版（embeddings は (件数, 次元) の配列）"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        rows = int(ids.max()) + 1
+        self._reserve(rows, vecs.shape[1])
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        self.matrix[ids] = np.divide(vecs, norms, out=np.array(vecs), where=norms > 0)
+        self.kinds[ids] = kind
+        self.size = max(self.size, rows)
+
+    def _reserve(self, rows, dim):
+        """rows 行・dim 次元が入るようにする（行列は倍々で確保する）"""
+        if self.matrix.shape[1] == 0:
+            self.matrix = np.zeros((0, dim), dtype=np.float32)
+        elif dim != self.matrix.shape[1]:
+            raise ValueError(f"Embedding dimension {dim} does not match {self.matrix.shape[1]}")
+        if rows > len(self.matrix):
+            capacity = max(rows, 2 * len(self.matrix), 1024)
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            matrix[:len(self.matrix)] = self.matrix
+            kinds = np.zeros(capacity, dtype=np.int8)
+            kinds[:len(self.kinds)] = self.kinds
+            self.matrix, self.kinds = matrix, kinds
+
+    def similarity(self, query_embedding, rows):
+        """クエリと指定した行の cosine 類似度"""
+        return self.matrix[rows] @ self._normalize(query_embedding)
+
+    def nearest(self, query_embedding, counts):
+        """
+        クエリに近い行を種類ごとに類似度の高い順で返す。
+        counts: {ENTITY: 3, CHUNK: 5} -> {ENTITY: (rows, scores), CHUNK: (rows, scores)}
+        候補の類似度は種類によらず1回の行列積で求める。
+        """
+        q = self._normalize(query_embedding)
+        rows = self._candidates(q)
+        scores = self.matrix[rows] @ q
+        kinds = self.kinds[rows]
+
+        result = {}
+        for kind, n in counts.items():
+            mask = kinds == kind
+            kind_rows, kind_scores = rows[mask], scores[mask]
+            if n < len(kind_rows):
+                top = np.argpartition(-kind_scores, n)[:n]
+                kind_rows, kind_scores = kind_rows[top], kind_scores[top]
+            order = np.argsort(-kind_scores, kind="stable")
+            result[kind] = (kind_rows[order], kind_scores[order])
+        return result
+
+    def _normalize(self, query_embedding):
+        q = np.asarray(query_embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(q)
+        return q / norm if norm else q
+
+    def prepare(self):
+        """行数が ann_min_rows 以上なら IVF 索引を（古ければ作り直して）用意する"""
+        if self.size < self.ann_min_rows:
+            return
+        # 索引を作った後に1割以上増えたら作り直す
+        if self._ivf is None or self.size > self._ivf[3] * 1.1:
+            self.build_index()
+
+    def _candidates(self, q):
+        """全行（小さいうち）または IVF で近いクラスタの行 + 索引後に追加された行"""
+        if self.size < self.ann_min_rows:
+            return np.arange(self.size)
+        self.prepare()
+        centroids, indptr, members, indexed = self._ivf
+        probe = np.argpartition(-(centroids @ q), min(self.nprobe, len(centroids)) - 1)[:self.nprobe]
+        parts = [members[indptr[c]:indptr[c + 1]] for c in probe.tolist()]
+        parts.append(np.arange(indexed, self.size))
+        return np.concatenate(parts)
+
+    def build_index(self, nlist=None, iterations=10):
+        """球面 k-means（サンプルで学習）で nlist 個のクラスタに分けた IVF 索引を作る"""
+        rows = np.flatnonzero(self.kinds[:self.size])
+        nlist = nlist or max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(self.seed)
+        sample = self.matrix[rng.choice(rows, size=min(len(rows), 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空になったクラスタは前の重心のまま
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        assign = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            assign[start:start + len(chunk)] = np.argmax(self.matrix[chunk] @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=nlist))))
+        self._ivf = (centroids, indptr, rows[order], self.size)
+
+
+def _contains(sorted_ids, ids):
+    """ids の各要素が昇順のID配列 sorted_ids に含まれるか（bool 配列）"""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return sorted_ids[pos] == ids
+
+
+def _membership(sets, ids):
+    """reach[i, j]: ids[i] が j 番目の昇順ID配列 sets[j] に含まれるか（bool, len(ids) x len(sets)）"""
+    reach = np.empty((len(ids), len(sets)), dtype=bool)
+    for j, sorted_ids in enumerate(sets):
+        reach[:, j] = _contains(sorted_ids, ids)
+    return reach
+
+# search_many のワーカープロセスが持つ SimpleMiniRAG（initializer で1回だけ受け取る）
+_worker_rag = None
+
+
+def _init_search_worker(rag):
+    global _worker_rag
+    _worker_rag = rag
+
+
+def _search_batch_in_worker(args):
+    return _worker_rag._search_batch(*args)
+
+
+class SimpleMiniRAG:
+    def __init__(self, index_hops=None, ann_min_rows=50_000, backend="networkx"):
+        # k-hop 近傍の索引（辺の追加で差分更新）。index_hops を超える k は BFS で求める。
+        # デフォルトは networkx なら 2、csr なら 1（巨大なグラフ向けなので、ハブで膨らむ 2-hop 索引は持たない）
+        if index_hops is None:
+            index_hops = 1 if backend == "csr" else 2
+        self.khop = KHopIndex(max_hops=index_hops)
+        # 異種グラフの初期化。backend="csr" は整数IDの配列で持つ省メモリ版
+        if backend == "networkx":
+            self.G = nx.Graph()
+        elif backend == "csr":
+            self.G = CSRGraph(self.khop)
+        else:
+            raise ValueError(f"Unknown graph backend: {backend} (choose from networkx, csr)")
+        # エンティティとチャンクの埋め込み（正規化済みの行列。行番号は khop のID）
+        self.embeddings = EmbeddingStore(self.khop.ids, ann_min_rows=ann_min_rows)
+        # 隣接行列（CSR）のキャッシュ。グラフを変更したら作り直す
+        self._adjacency = None
 
     def add_chunk(self, chunk_id, content, embedding):
         """チャンクノードの追加"""
         self.G.add_node(chunk_id, type='chunk', content=content)
-        self.embeddings[chunk_id] = embedding
+        self.embeddings.add(self.khop.add_node(chunk_id), embedding, CHUNK)
+        self._adjacency = None
 
     def add_entity(self, entity_id, entity_type, embedding):
         """エンティティノードの追加"""
         self.G.add_node(entity_id, type='entity', entity_type=entity_type)
-        self.embeddings[entity_id] = embedding
+        self.embeddings.add(self.khop.add_node(entity_id), embedding, ENTITY)
+        self._adjacency = None
 
     def add_relation(self, source, target, relation_type, description=""):
         """エッジの追加（Entity-Entity または Entity-Chunk）"""
+        is_new = not self.G.has_edge(source, target)
         self.G.add_edge(source, target, relation=relation_type, desc=description)
+        if is_new:
+            self.khop.add_edge(source, target)
+        self._adjacency = None
+
+    def add_chunks(self, chunk_ids, contents, embeddings):
+        """add_chunk の一括版（embeddings は (件数, 次元) の配列）"""
+        self.G.add_nodes_from((c, {"type": "chunk", "content": t}) for c, t in zip(chunk_ids, contents))
+        self.embeddings.add_many(self.khop.add_nodes(chunk_ids), embeddings, CHUNK)
+        self._adjacency = None
+
+    def add_entities(self, entity_ids, entity_types, embeddings):
+        """add_entity の一括版（embeddings は (件数, 次元) の配列）"""
+        self.G.add_nodes_from((e, {"type": "entity", "entity_type": t}) for e, t in zip(entity_ids, entity_types))
+        self.embeddings.add_many(self.khop.add_nodes(entity_ids), embeddings, ENTITY)
+        self._adjacency = None
+
+    def add_relations(self, sources, targets, relation_types, descriptions=None):
+        """add_relation の一括版。CSR バックエンドでは既存の辺の判定と追加を配列演算で行う"""
+        if descriptions is None:
+            descriptions = [""] * len(sources)
+        # 1件ずつ追加したときと同じ順に ID を振る
+        ids = self.khop.add_nodes([n for pair in zip(sources, targets) for n in pair])
+        a, b = ids[0::2], ids[1::2]
+        if isinstance(self.G, CSRGraph):
+            is_new = self.G.add_edges(a, b, relation_types, descriptions)
+        else:
+            is_new = []
+            for u, v, relation_type, description in zip(sources, targets, relation_types, descriptions):
+                is_new.append(not self.G.has_edge(u, v))
+                self.G.add_edge(u, v, relation=relation_type, desc=description)
+            is_new = np.array(is_new, dtype=bool)
+        self.khop.add_edges(a[is_new], b[is_new])
+        self._adjacency = None
+
+    def _get_adjacency(self):
+        """隣接行列（CSR）を返す（グラフ変更時のみ作り直す）"""
+        if self._adjacency is None:
+            self._adjacency = self.khop.adjacency()
+        return self._adjacency
+
+    def _k_hop_reach(self, start_nodes, answer_candidates, k):
+        """
+        start_nodes / answer_candidates の各ノードから k-hop 以内にあるノードをまとめて求める。
+        k <= index_hops なら索引の参照、それより大きければ多始点BFS（隣接行列とのスパース積を k 回）。
 
-    def _get_k_hop_subgraph(self, edge, k=2):
-        """エッジ周辺のk-hopサブグラフを取得"""
-        u, v = edge
-        nodes_u = nx.single_source_shortest_path_length(self.G, u, cutoff=k).keys()
-        nodes_v = nx.single_source_shortest_path_length(self.G, v, cutoff=k).keys()
-        return set(nodes_u) | set(nodes_v)
+        戻り値: (index, reach, weights)
+          reach[i, j] は ノード i が j 番目の起点から k-hop 以内か（bool, ノード数 x 起点数）
+          weights[j] は j 番目の起点が start_nodes / answer_candidates に現れる回数
+        """
+        index = self.khop.ids
+        sources = {}
+        for n in list(start_nodes) + list(answer_candidates):
+            # グラフにないノードはどのサブグラフにも含まれない
+            if n in index:
+                sources[n] = sources.get(n, 0) + 1
+
+        reach = np.zeros((len(index), len(sources)), dtype=bool)
+        if k <= self.khop.max_hops:
+            for j, n in enumerate(sources):
+                reach[self.khop.within(index[n], k), j] = True
+        else:
+            reach[[index[n] for n in sources], np.arange(len(sources))] = True
+            adj = self._get_adjacency()
+            for _ in range(k):
+                frontier = adj @ reach.astype(np.float32)
+                reach |= frontier > 0
+        weights = np.fromiter(sources.values(), dtype=np.int64, count=len(sources))
+        return index, reach, weights
+
+    def _within(self, i, k, cache=None):
+        """
+        ID i から k-hop 以内のノードID（昇順）。k <= index_hops なら索引の参照、
+        それより大きければ (k-1)-hop 近傍の隣接ノードを足して求める（cache があれば使い回す）
+        """
+        if k <= self.khop.max_hops:
+            return self.khop.within(i, k)
+        ids = cache.get((i, k)) if cache is not None else None
+        if ids is None:
+            inner = self._within(i, k - 1, cache)
+            ids = np.union1d(inner, self._get_adjacency()[inner].indices).astype(np.int32)
+            if cache is not None:
+                cache[(i, k)] = ids
+        return ids
 
     def calculate_edge_score(self, start_nodes, answer_candidates, k=1):
-        """Eq(2): エッジの重要度スコア ω_e を計算"""
-        edge_scores = {}
-        
-        for u, v in self.G.edges():
-            subgraph_nodes = self._get_k_hop_subgraph((u, v), k)
-            
-            # クエリエンティティ(start_nodes)が近傍にいくつあるか
-            score_s = sum(1 for n in start_nodes if n in subgraph_nodes)
-            # 答え候補(answer_candidates)が近傍にいくつあるか
-            score_a = sum(1 for n in answer_candidates if n in subgraph_nodes)
-            
-            edge_scores[(u, v)] = score_s + score_a
-            
-        return edge_scores
-
-    def search(self, query_embedding, start_nodes, answer_candidates, top_k=3):
-        """Eq(3): パス探索とスコアリング"""
-        # 1. エッジスコア計算
-        edge_scores = self.calculate_edge_score(start_nodes, answer_candidates)
-        
-        paths = []
-        
+        """
+        Eq(2): エッジの重要度スコア ω_e を計算
+
+        エッジ (u, v) の k-hop サブグラフは u または v から k-hop 以内のノードなので、
+        起点ごとの到達範囲を一度だけ求め、全エッジを配列演算でまとめて採点する。
+        """
+        nodes = self.khop.nodes
+        edge_u, edge_v = self.khop.edges()
+        _, reach, weights = self._k_hop_reach(start_nodes, answer_candidates, k)
+
+        # クエリエンティティ(start_nodes)と答え候補(answer_candidates)が近傍にいくつあるか
+        scores = (reach[edge_u] | reach[edge_v]) @ weights
+        keys = zip(map(nodes.__getitem__, edge_u.tolist()), map(nodes.__getitem__, edge_v.tolist()))
+        return dict(zip(keys, scores.tolist()))
+
+    def _neighbours(self, i):
+        """ID i の隣接ノードID（自身を除く）"""
+        if self.khop.max_hops >= 1:
+            ids = self.khop.within(i, 1)
+        else:
+            adj = self._get_adjacency()
+            ids = adj.indices[adj.indptr[i]:adj.indptr[i + 1]]
+        return ids[ids != i]
+
+    def retrieve(self, query_embedding, num_entities=3, num_chunks=5):
+        """
+        クエリの埋め込みに近いエンティティ（start_nodes）とチャンク（answer_candidates）を
+        1回の行列積（大きいグラフでは近似最近傍探索）でまとめて選ぶ
+        """
+        found = self.embeddings.nearest(query_embedding, {ENTITY: num_entities, CHUNK: num_chunks})
+        nodes = self.khop.nodes
+        return (
+            [nodes[i] for i in found[ENTITY][0].tolist()],
+            [nodes[i] for i in found[CHUNK][0].tolist()],
+        )
+
+    def search(self, query_embedding, start_nodes=None, answer_candidates=None, top_k=3,
+               num_entities=3, num_chunks=5):
+        """
+        Eq(3): パス探索とスコアリング
+
+        start_nodes / answer_candidates を省略すると、retrieve() でクエリに近い
+        エンティティ num_entities 個 / チャンク num_chunks 個を使う。
+        start_node から長さ2までの単純パスを、スコアの上界が高い順に展開する最良優先探索で
+        たどり、上位 top_k 本が確定した時点で打ち切る（全パスを列挙してソートしない）。
+        """
+        if top_k <= 0:
+            return []
+        start_nodes, answer_candidates = self._resolve_nodes(
+            query_embedding, start_nodes, answer_candidates, num_entities, num_chunks)
+        return self._search_paths(query_embedding, start_nodes, answer_candidates, top_k)
+
+    def search_many(self, query_embeddings, start_nodes=None, answer_candidates=None, top_k=3,
+                    num_entities=3, num_chunks=5, batch_size=64, workers=None, pool_min_queries=4096):
+        """
+        複数クエリの search をまとめて行い、結果（パスのリスト）を入力順に返す。
+
+        start_nodes / answer_candidates はクエリごとのリスト（要素が None なら retrieve() で選ぶ）。
+        batch_size 個ずつのクエリで近傍の計算を共有し（index_hops を超える近傍は起点ごとにバッチで1回だけ
+        求める）。デフォルトは同じプロセスで処理する。workers > 1 かつクエリが pool_min_queries 件以上のときだけ
+        バッチをプロセスプールで並列に処理する（ワーカーごとに索引を pickle して渡すコストの方が
+        検索より大きくなるので、少ないクエリではかえって遅い）。workers は CPU 数までに抑える。
+        """
+        queries = list(query_embeddings)
+        n = len(queries)
+        start_nodes = [None] * n if start_nodes is None else list(start_nodes)
+        answer_candidates = [None] * n if answer_candidates is None else list(answer_candidates)
+        if len(start_nodes) != n or len(answer_candidates) != n:
+            raise ValueError(
+                f"Got {n} queries, {len(start_nodes)} start node sets and "
+                f"{len(answer_candidates)} answer candidate sets")
+        if top_k <= 0:
+            return [[] for _ in range(n)]
+
+        batches = [
+            (queries[i:i + batch_size], start_nodes[i:i + batch_size], answer_candidates[i:i + batch_size],
+             top_k, num_entities, num_chunks)
+            for i in range(0, n, batch_size)
+        ]
+        workers = min(workers or 1, os.cpu_count() or 1)
+        if workers <= 1 or len(batches) <= 1 or n < pool_min_queries:
+            results = [self._search_batch(*batch) for batch in batches]
+        else:
+            # 遅延している索引の更新をここで済ませ、各ワーカーが同じ作業を繰り返さないようにする
+            self.khop.within(0, 0)
+            if self.khop.max_hops < 2:
+                self._get_adjacency()
+            self.embeddings.prepare()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker,
+                                     initargs=(self,)) as pool:
+                results = list(pool.map(_search_batch_in_worker, batches))
+        return [paths for batch in results for paths in batch]
+
+    def _search_batch(self, queries, start_nodes, answer_candidates, top_k, num_entities, num_chunks):
+        """search_many の1バッチ（プロセスプールでは1タスク）"""
+        resolved = [
+            self._resolve_nodes(q, s, a, num_entities, num_chunks)
+            for q, s, a in zip(queries, start_nodes, answer_candidates)
+        ]
+        # index_hops を超える近傍（BFS）は同じバッチのクエリで使い回す
+        cache = {}
+        return [self._search_paths(q, s, a, top_k, cache) for q, (s, a) in zip(queries, resolved)]
+
+    def _resolve_nodes(self, query_embedding, start_nodes, answer_candidates, num_entities, num_chunks):
+        """省略された start_nodes / answer_candidates を retrieve() で補う"""
+        if start_nodes is None or answer_candidates is None:
+            entities, chunks = self.retrieve(query_embedding, num_entities, num_chunks)
+            start_nodes = entities if start_nodes is None else start_nodes
+            answer_candidates = chunks if answer_candidates is None else answer_candidates
+        return start_nodes, answer_candidates
+
+    def _search_paths(self, query_embedding, start_nodes, answer_candidates, top_k, cache=None):
+        """
+        search の本体（start_nodes / answer_candidates は決まっている）。
+        起点ごとの近傍は昇順のID配列のまま持ち、パス上のノードについてだけ二分探索で調べるので、
+        1クエリの計算量はグラフ全体のノード数によらない。cache は search_many がバッチで共有する近傍。
+        """
+        index = self.khop.ids
+        sources = {}
+        for n in list(start_nodes) + list(answer_candidates):
+            # グラフにないノードはどのサブグラフにも含まれない
+            if n in index:
+                sources[n] = sources.get(n, 0) + 1
+        source_ids = [index[n] for n in sources]
+        weights = np.fromiter(sources.values(), dtype=np.int64, count=len(sources))
+        near = [self._within(i, 1, cache) for i in source_ids]
+        answer_ids = np.unique(np.array([index[n] for n in answer_candidates if n in index], dtype=np.int32))
+
+        # 1. エッジスコア計算（パス上のエッジだけを、起点ごとの1-hop近傍から求める）
+        # エッジ (x, y) のスコアは base[x] + (reach[y] & ~reach[x]) @ weights
+        def step_factors(x, candidates):
+            # パス ... -> x -> candidates の、最後の1歩で増える (1 + 答え候補の数 + エッジスコアの和) の分
+            reach_x = _membership(near, np.array([x]))[0]
+            return (_contains(answer_ids, candidates) + reach_x @ weights
+                    + (_membership(near, candidates) & ~reach_x) @ weights)
+
+        # x から1歩伸ばしたときに増えうるスコアの上限:
+        #   エッジの分（x の隣に起点の1-hop近傍があれば、その起点の重み）+ 答え候補の分
+        near_next = [self._within(i, 2, cache) for i in source_ids]
+        near_answer = np.unique(np.concatenate(
+            [np.zeros(0, dtype=np.int32)] + [self._neighbours(a) for a in answer_ids.tolist()]))
+
+        def extend_bound(ids):
+            reach = _membership(near, ids)
+            return reach @ weights + _contains(near_answer, ids) + (_membership(near_next, ids) & ~reach) @ weights
+
+        # ヒープの要素: (-上界, 通し番号, 種類, ...)。上界の高い順に取り出す
+        heap = []
+        seq = itertools.count()
+
+        def push_cursor(sim, prefix, ids, factors, kind, keys):
+            # 候補を良い順に並べ、先頭だけをヒープに載せて必要になったら次を出す
+            order = np.argsort(-keys if sim >= 0 else keys, kind="stable")
+            ids, factors, keys = ids[order].tolist(), factors[order].tolist(), keys[order].tolist()
+            if ids:
+                heapq.heappush(heap, (-sim * keys[0], next(seq), kind, sim, prefix, ids, factors, keys, 0))
+
+        # クエリとの類似度 ω_v (Cosine Similarity)。正規化済みの行列なので行列積1回で求まる
+        start_ids = [index[n] for n in start_nodes]
+        sims = self.embeddings.similarity(query_embedding, start_ids).tolist()
+
         # start_nodesから始まるパスを探索（簡易的に長さ2までとする）
-        for start_node in start_nodes:
-            # クエリとの類似度 ω_v (Cosine Similarity)
-            sim = cosine_similarity(
-                [query_embedding], 
-                [self.embeddings[start_node]]
-            )[0][0]
-            
-            # 2-hop先のノードまで探索
-            for target in nx.single_source_shortest_path_length(self.G, start_node, cutoff=2).keys():
-                if target == start_node: continue
-                
-                # 単純パスを取得
-                for path in nx.all_simple_paths(self.G, start_node, target, cutoff=2):
-                    # Eq(3)の実装
-                    # パスに含まれるエッジのスコア合計
-                    path_edge_score_sum = 0
-                    path_edges = list(zip(path, path[1:]))
-                    for edge in path_edges:
-                        # 無向グラフなので順序ケア
-                        e_score = edge_scores.get(edge, edge_scores.get((edge[1], edge[0]), 0))
-                        path_edge_score_sum += e_score
-                    
-                    # 答え候補が含まれているか
-                    contains_answer = sum(1 for n in path if n in answer_candidates)
-
-                    # 最終スコア ω_p
-                    path_score = sim * (1 + contains_answer + path_edge_score_sum)
-                    
-                    paths.append({
-                        "path": path,
-                        "score": path_score,
-                        "chunks": [n for n in path if self.G.nodes[n].get('type') == 'chunk']
-                    })
-
-        # スコア順にソート
-        sorted_paths = sorted(paths, key=lambda x: x['score'], reverse=True)
-        return sorted_paths[:top_k]
+        for s, sim in zip(start_ids, sims):
+            ids = self._neighbours(s)
+            factors = 1 + _contains(answer_ids, np.array([s]))[0] + step_factors(s, ids)
+            # sim >= 0 なら x を経由するパスの上界、sim < 0 ならスコアが最大になるのは [s, x] 自身
+            keys = factors + extend_bound(ids) if sim >= 0 else factors
+            push_cursor(sim, (s,), ids, factors, "hop1", keys)
+
+        paths = []
+        while heap and len(paths) < top_k:
+            entry = heapq.heappop(heap)
+            neg_bound, _, kind = entry[:3]
+            if kind == "path":
+                path = [self.khop.nodes[i] for i in entry[3]]
+                # 最終スコア ω_p
+                paths.append({
+                    "path": path,
+                    "score": -neg_bound,
+                    "chunks": [n for i, n in zip(entry[3], path) if self.embeddings.kind(i) == CHUNK]
+                })
+                continue
+
+            _, _, kind, sim, prefix, ids, factors, keys, pos = entry
+            if pos + 1 < len(ids):
+                heapq.heappush(heap, (-sim * keys[pos + 1], next(seq), kind, sim, prefix, ids, factors, keys, pos + 1))
+
+            x, factor = ids[pos], factors[pos]
+            path = prefix + (x,)
+            heapq.heappush(heap, (-(sim * factor), next(seq), "path", path))
+            if kind == "hop1":
+                # 2歩目: start_node に戻る / 同じノードを2回通るパスは除く
+                candidates = self._neighbours(x)
+                candidates = candidates[candidates != prefix[0]]
+                step = factor + step_factors(x, candidates)
+                push_cursor(sim, path, candidates, step, "hop2", step)
+
+        return paths
 
 # --- 実行パート ---
 
-# 1. データのセットアップ（論文の「ハウスルール」の例を模倣）
-rag = SimpleMiniRAG()
-
-# 埋め込みはランダムベクトルで代用
-v_dim = 64
-emb_lihua = np.random.rand(v_dim)
-emb_adam = np.random.rand(v_dim)
-emb_rule = np.random.rand(v_dim)
-emb_wifi = np.random.rand(v_dim)
-emb_query = emb_rule + np.random.normal(0, 0.1, v_dim) # Queryは"House Rules"に近いと仮定
-
-# ノード追加
-rag.add_entity("LiHua", "Person", emb_lihua)
-rag.add_entity("Adam", "Person", emb_adam)
-rag.add_entity("HouseRules", "Concept", emb_rule)
-rag.add_chunk("Chunk1", "Adam: Keep noise down at night.", np.random.rand(v_dim))
-rag.add_chunk("Chunk2", "Wifi password is Family123.", np.random.rand(v_dim))
-
-# エッジ追加（関係性を定義）
-rag.add_relation("LiHua", "Adam", "friend")
-rag.add_relation("Adam", "Chunk1", "author_of")
-rag.add_relation("HouseRules", "Chunk1", "mentioned_in") # HouseRulesはChunk1に関連
-rag.add_relation("Adam", "Chunk2", "author_of")
-
-# 2. 検索シミュレーション
-# クエリ: "What are the House Rules?" -> Entity extraction: "HouseRules"
-# 想定: HouseRulesからChunk1へのパスが高く評価されるはず
-
-print("🔍 Searching MiniRAG Graph...")
-results = rag.search(
-    query_embedding=emb_query,
-    start_nodes=["HouseRules"],     # クエリから抽出されたエンティティ
-    answer_candidates=["Chunk1"]    # 本来は推論で候補を出すが、ここではChunk1をターゲットと仮定
-)
-
-for i, res in enumerate(results):
-    print(f"\n🏆 Rank {i+1} (Score: {res['score']:.4f})")
-    print(f"   Path: {res['path']}")
-    print(f"   Relevant Chunks: {res['chunks']}")
\ No newline at end of file
+if __name__ == "__main__":
+
+    # 1. データのセットアップ（論文の「ハウスルール」の例を模倣）
+    rag = SimpleMiniRAG()
+
+    # 埋め込みはランダムベクトルで代用
+    v_dim = 64
+    emb_lihua = np.random.rand(v_dim)
+    emb_adam = np.random.rand(v_dim)
+    emb_rule = np.random.rand(v_dim)
+    emb_wifi = np.random.rand(v_dim)
+    emb_query = emb_rule + np.random.normal(0, 0.1, v_dim) # Queryは"House Rules"に近いと仮定
+
+    # ノード追加
+    rag.add_entity("LiHua", "Person", emb_lihua)
+    rag.add_entity("Adam", "Person", emb_adam)
+    rag.add_entity("HouseRules", "Concept", emb_rule)
+    rag.add_chunk("Chunk1", "Adam: Keep noise down at night.", np.random.rand(v_dim))
+    rag.add_chunk("Chunk2", "Wifi password is Family123.", np.random.rand(v_dim))
+
+    # エッジ追加（関係性を定義）
+    rag.add_relation("LiHua", "Adam", "friend")
+    rag.add_relation("Adam", "Chunk1", "author_of")
+    rag.add_relation("HouseRules", "Chunk1", "mentioned_in") # HouseRulesはChunk1に関連
+    rag.add_relation("Adam", "Chunk2", "author_of")
+
+    # 2. 検索シミュレーション
+    # クエリ: "What are the House Rules?" -> Entity extraction: "HouseRules"
+    # 想定: HouseRulesからChunk1へのパスが高く評価されるはず
+
+    print("🔍 Searching MiniRAG Graph...")
+    results = rag.search(
+        query_embedding=emb_query,
+        start_nodes=["HouseRules"],     # クエリから抽出されたエンティティ
+        answer_candidates=["Chunk1"]    # 本来は推論で候補を出すが、ここではChunk1をターゲットと仮定
+    )
+
+    for i, res in enumerate(results):
+        print(f"\n🏆 Rank {i+1} (Score: {res['score']:.4f})")
+        print(f"   Path: {res['path']}")
+        print(f"   Relevant Chunks: {res['chunks']}")